@@ -0,0 +1,122 @@
+import logging
+import os
+import threading
+import time
+
+from serial_stream import TIMEOUT_RESPONSE
+
+
+logger = logging.getLogger(__name__)
+
+# How many operations in a row have to fail before we stop sending
+# work to a modem.
+BREAKER_THRESHOLD = int(os.environ.get('GSM_BREAKER_THRESHOLD', 3))
+# How long we wait between attempts to recover a modem, in seconds.
+BREAKER_RETRY_INTERVAL = float(os.environ.get('GSM_BREAKER_RETRY_INTERVAL', 30))
+
+# The modem takes work.
+CIRCUIT_CLOSED = 'closed'
+# The modem failed too many times. Work fails right away until it
+# has recovered.
+CIRCUIT_OPEN = 'open'
+# We're trying to bring the modem back.
+CIRCUIT_RECOVERING = 'recovering'
+
+
+class CircuitOpen(Exception):
+    """Raised instead of running an operation on a modem that keeps
+    failing, until it has recovered."""
+
+
+def is_failure(res):
+    """Returns whether the result of an operation means the modem
+    didn't answer a command (`TIMEOUT_RESPONSE`), as opposed to eg.
+    the network rejecting a message (+CMS ERROR) or a call nobody
+    picked up."""
+    if not isinstance(res, dict):
+        return False
+    return TIMEOUT_RESPONSE in (res.get('res', None), res.get('error', None))
+
+
+class CircuitBreaker(object):
+    """Counts the operations of a modem that fail in a row.
+
+    Once `threshold` of them have failed, the circuit opens: work
+    fails right away with `CircuitOpen` and `on_open()` is called so
+    the modem can be recovered. `close()` lets work through again.
+    """
+
+    def __init__(self, number, threshold=BREAKER_THRESHOLD, on_open=None):
+        self.number = number
+        self.threshold = threshold
+        self.on_open = on_open
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        self.opened = None
+        # How many recoveries were ever attempted.
+        self.recoveries = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        return self.state == CIRCUIT_CLOSED
+
+    def check(self):
+        """Raises `CircuitOpen` unless the modem takes work."""
+        if not self.allow():
+            raise CircuitOpen('Modem %s is %s.' % (self.number, self.state))
+
+    def run(self, fn, ser, *args, **kwargs):
+        """Runs the operation `fn(ser, *args, **kwargs)` and records
+        whether it failed. Raises `CircuitOpen` without running it if
+        the circuit is open."""
+        self.check()
+        try:
+            res = fn(ser, *args, **kwargs)
+        except Exception as e:
+            self.record(False, '%s: %s' % (e.__class__.__name__, e))
+            raise
+        self.record(not is_failure(res), res.get('error', None)
+            if isinstance(res, dict) else None)
+        return res
+
+    def record(self, ok, error=None):
+        with self._lock:
+            if ok:
+                self.failures = 0
+                return
+            self.failures += 1
+            self.last_error = error
+            if self.state != CIRCUIT_CLOSED or self.failures < self.threshold:
+                return
+            self.state = CIRCUIT_OPEN
+            self.opened = time.time()
+        logger.warning('BREAKER::Opened: %s after %s failures (%s)' % (
+            self.number, self.failures, error))
+        if self.on_open:
+            self.on_open()
+
+    def recovering(self):
+        with self._lock:
+            self.state = CIRCUIT_RECOVERING
+            self.recoveries += 1
+
+    def fail_recovery(self):
+        with self._lock:
+            self.state = CIRCUIT_OPEN
+
+    def close(self):
+        with self._lock:
+            self.state = CIRCUIT_CLOSED
+            self.failures = 0
+            self.opened = None
+        logger.info('BREAKER::Closed: %s' % self.number)
+
+    def to_dict(self):
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'opened': self.opened,
+            'recoveries': self.recoveries,
+            'last_error': self.last_error,
+        }
@@ -0,0 +1,160 @@
+"""Modem broker.
+
+Owns every serial port in a single long-lived process and exposes
+the `ModemPool` over a Unix socket, so any number of HTTP workers can
+share the modems.
+
+The protocol is one JSON object per line. A request looks like
+`{"method": "run", "args": [...], "kwargs": {...}}` and the response
+is either `{"result": ...}` or `{"error": "<exception>", "message": ...}`.
+"""
+import json
+import logging
+import os
+import socket
+import SocketServer
+
+import breaker
+import hotplug
+import initialize
+import jobs
+import modem_pool
+import modem_worker
+import sim_cache
+
+
+logger = logging.getLogger(__name__)
+
+BROKER_SOCKET = os.environ.get('GSM_BROKER_SOCKET', '/tmp/gsm-broker.sock')
+
+# `ModemPool` methods clients are allowed to call.
+RPC_METHODS = [
+    'available_numbers',
+    'unused_ports',
+    'probes',
+    'pacing',
+    'health_report',
+    'circuits',
+    'interfaces',
+    'pick',
+    'run',
+    'messages',
+    'inbox_version',
+    'clear_inbox',
+    'storage',
+    'ussd',
+    'wait_for_sms',
+    'wait_for_call',
+    'submit_job',
+    'send_bulk',
+    'job',
+    'finished_jobs',
+    'last_event_id',
+    'events_since',
+]
+
+# Exceptions we re-raise as-is on the client side.
+RPC_EXCEPTIONS = {
+    'UnknownModem': modem_pool.UnknownModem,
+    'UnknownOperation': modem_pool.UnknownOperation,
+    'UnknownJob': jobs.UnknownJob,
+    'TaskExpired': modem_worker.TaskExpired,
+    'CircuitOpen': breaker.CircuitOpen,
+}
+
+
+class BrokerError(Exception):
+    """Raised on the client when the broker fails a request."""
+
+
+class BrokerHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            res = self.dispatch(line)
+            self.wfile.write(json.dumps(res) + '\n')
+            self.wfile.flush()
+
+    def dispatch(self, line):
+        try:
+            req = json.loads(line)
+            method = req['method']
+            if method not in RPC_METHODS:
+                raise BrokerError('Unknown method: %s' % method)
+            fn = getattr(self.server.pool, method)
+            return {'result': fn(*req.get('args', []), **req.get('kwargs', {}))}
+        except Exception as e:
+            if e.__class__.__name__ not in RPC_EXCEPTIONS:
+                logger.exception('BROKER::Request failed: %s' % line)
+            return {'error': e.__class__.__name__, 'message': str(e)}
+
+
+class Broker(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, pool, path=BROKER_SOCKET):
+        self.pool = pool
+        # Remove a socket left behind by a previous broker.
+        if os.path.exists(path):
+            os.remove(path)
+        SocketServer.UnixStreamServer.__init__(self, path, BrokerHandler)
+        os.chmod(path, 0o660)
+
+
+class BrokerClient(object):
+    """Calls the `ModemPool` methods of a broker. Exposes the same
+    interface as the methods in `RPC_METHODS`.
+
+    Every call uses its own connection so a client can be shared
+    between threads and long calls don't block each other.
+    """
+
+    def __init__(self, path=BROKER_SOCKET):
+        self.path = path
+
+    def _call(self, method, *args, **kwargs):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            f = sock.makefile('rwb')
+            f.write(json.dumps({
+                'method': method,
+                'args': args,
+                'kwargs': kwargs,
+            }) + '\n')
+            f.flush()
+            line = f.readline()
+        finally:
+            sock.close()
+        if not line:
+            raise BrokerError('Broker closed the connection.')
+        res = json.loads(line)
+        if 'error' in res:
+            exc = RPC_EXCEPTIONS.get(res['error'], BrokerError)
+            raise exc(res['message'])
+        return res['result']
+
+    def __getattr__(self, name):
+        if name not in RPC_METHODS:
+            raise AttributeError(name)
+        def call(*args, **kwargs):
+            return self._call(name, *args, **kwargs)
+        return call
+
+
+def main():
+    pool = modem_pool.ModemPool()
+    logger.info('BROKER::Initializing modems...')
+    cache = sim_cache.SimCache()
+    pool.initialize(initialize.get_modems(), cache=cache)
+    if hotplug.HOTPLUG_INTERVAL:
+        hotplug.PortWatcher(pool, cache=cache).start()
+    logger.info('BROKER::Serving %s modems on %s' % (
+        len(pool.available_numbers()), BROKER_SOCKET))
+    Broker(pool).serve_forever()
+
+
+if __name__ == '__main__':
+    import sys
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+    main()
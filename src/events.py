@@ -0,0 +1,70 @@
+import collections
+import threading
+import time
+
+from serial_utils import monotonic
+
+
+# How many events we keep for clients catching up.
+EVENT_LOG_SIZE = 1000
+
+EVENT_SMS = 'sms'
+EVENT_RING = 'ring'
+EVENT_HANGUP = 'hangup'
+EVENT_STATUS_REPORT = 'status_report'
+
+
+def matches(event, number=None, types=None, origin=None):
+    """Tells whether an event passes the given filters. `origin` only
+    applies to messages and matches like `wait_for_sms` does."""
+    if number is not None and event['number'] != number:
+        return False
+    if types and event['type'] not in types:
+        return False
+    if origin:
+        m = event.get('message', None)
+        if not m or origin.lower() not in (m['origin'] or '').lower():
+            return False
+    return True
+
+
+class EventLog(object):
+    """Keeps the latest modem events, each with an increasing id, so
+    clients can wait for and catch up on events after the last one
+    they've seen."""
+
+    def __init__(self, size=EVENT_LOG_SIZE):
+        self._events = collections.deque(maxlen=size)
+        self._last_id = 0
+        self._cond = threading.Condition()
+
+    def publish(self, event):
+        with self._cond:
+            self._last_id += 1
+            event['id'] = self._last_id
+            event['time'] = time.time()
+            self._events.append(event)
+            self._cond.notify_all()
+        return event
+
+    def last_id(self):
+        return self._last_id
+
+    def since(self, after=0, timeout=0, **filters):
+        """Returns the events after the event id `after` that pass the
+        filters (see `matches()`). Waits up to `timeout` seconds for
+        at least one such event."""
+        deadline = monotonic() + timeout
+        with self._cond:
+            while True:
+                events = []
+                for e in reversed(self._events):
+                    if e['id'] <= after:
+                        break
+                    if matches(e, **filters):
+                        events.append(e)
+                events.reverse()
+                remaining = deadline - monotonic()
+                if events or remaining <= 0:
+                    return events
+                self._cond.wait(remaining)
@@ -0,0 +1,97 @@
+import collections
+import logging
+import os
+import threading
+import time
+
+import breaker
+import serial_gsm
+from modem_worker import Task, PRIORITY_BATCH
+
+
+logger = logging.getLogger(__name__)
+
+# How often we sample every modem, in seconds.
+HEALTH_INTERVAL = float(os.environ.get('GSM_HEALTH_INTERVAL', 60))
+# How many samples we keep per modem.
+HEALTH_WINDOW = 10
+# AT+CSQ reports 99 when it doesn't know the signal strength.
+RSSI_UNKNOWN = 99
+
+
+def sample(ser):
+    """Returns the signal quality, registration status and operator
+    of a modem, and the `error` of the signal check if it failed."""
+    signal = serial_gsm.check_signal(ser, timeout=2)
+    status = serial_gsm.network_status(ser)
+    rssi = int(signal['rssi']) if signal['rssi'] else None
+    status.update({
+        'time': time.time(),
+        'rssi': None if rssi == RSSI_UNKNOWN else rssi,
+        'ber': signal['ber'],
+        'error': signal['error'],
+    })
+    return status
+
+
+class HealthSampler(threading.Thread):
+    """Samples every modem of a pool in the background and keeps the
+    last `window` samples of each.
+
+    Sampling is queued on the modem's worker like any other
+    operation, but never behind other work: busy modems are skipped
+    until they're idle.
+    """
+
+    def __init__(self, pool, interval=HEALTH_INTERVAL, window=HEALTH_WINDOW):
+        super(HealthSampler, self).__init__(name='health-sampler')
+        self.daemon = True
+        self.pool = pool
+        self.interval = interval
+        self.window = window
+        self._samples = {}  # number -> deque of samples
+        self._tasks = {}  # number -> Task of the running sample
+
+    def run(self):
+        while True:
+            try:
+                self.sample_all()
+            except Exception:
+                logger.exception('HEALTH::Sampling failed')
+            time.sleep(self.interval)
+
+    def sample_all(self):
+        for number, worker in self.pool.workers.items():
+            running = self._tasks.get(number, None)
+            if worker.pending() or (running and not running.done()):
+                continue
+            self._tasks[number] = worker.put(Task(self.record, (number,),
+                priority=PRIORITY_BATCH))
+
+    def record(self, ser, number):
+        """Samples the modem on `ser` and records the sample. Runs on
+        the modem's worker. Whether the modem answered counts towards
+        its circuit breaker like any other operation."""
+        s = sample(ser)
+        self._samples.setdefault(number, collections.deque(
+            maxlen=self.window)).append(s)
+        circuit = self.pool.breakers.get(number, None)
+        if circuit:
+            circuit.record(not breaker.is_failure(s), s['error'])
+
+    def forget(self, number):
+        self._samples.pop(number, None)
+        self._tasks.pop(number, None)
+
+    def summary(self, number):
+        """Returns the last sample of a modem along with the average
+        signal strength over the window, or None before the first
+        sample."""
+        samples = list(self._samples.get(number, []))
+        if not samples:
+            return None
+        rssis = [s['rssi'] for s in samples if s['rssi'] is not None]
+        summary = dict(samples[-1])
+        summary['rssi_avg'] = float(sum(rssis)) / len(rssis) if rssis else None
+        summary['samples'] = len(samples)
+        return summary
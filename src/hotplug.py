@@ -0,0 +1,86 @@
+import logging
+import os
+import threading
+import time
+
+import initialize
+from serial_utils import monotonic
+
+
+logger = logging.getLogger(__name__)
+
+# How often we look for modems that were plugged in or out, in
+# seconds. Listing the ports is cheap. 0 turns the watcher off.
+HOTPLUG_INTERVAL = float(os.environ.get('GSM_HOTPLUG_INTERVAL', 5))
+# How long we wait before probing a port that failed its probe again,
+# eg. a modem that was still booting.
+HOTPLUG_RETRY_INTERVAL = float(os.environ.get('GSM_HOTPLUG_RETRY_INTERVAL', 60))
+
+
+class PortWatcher(threading.Thread):
+    """Lists the ports every `interval` seconds, adds the modems that
+    were plugged in since and removes the ones that were unplugged.
+
+    New ports are probed on a thread of their own, so the pool keeps
+    serving the other modems while a slow port is probed.
+    """
+
+    def __init__(self, pool, list_ports=initialize.get_modems, cache=None,
+            interval=HOTPLUG_INTERVAL, retry_interval=HOTPLUG_RETRY_INTERVAL):
+        super(PortWatcher, self).__init__(name='hotplug')
+        self.daemon = True
+        self.pool = pool
+        self.list_ports = list_ports
+        self.cache = cache
+        self.interval = interval
+        self.retry_interval = retry_interval
+        self._probing = set()
+        # Ports that failed their last probe -> when. Ports that
+        # failed when the pool was initialized count too.
+        now = monotonic()
+        self._failed = dict((r['port'], now) for r in pool.probes()
+            if r['error'])
+
+    def run(self):
+        while True:
+            try:
+                self.scan()
+            except Exception:
+                logger.exception('HOTPLUG::Scan failed')
+            time.sleep(self.interval)
+
+    def scan(self):
+        ports = set(self.list_ports())
+        for port in set(self.pool.ports) - ports:
+            logger.info('HOTPLUG::Unplugged: %s' % port)
+            self.pool.remove_port(port)
+        for port in set(self._failed) - ports:
+            del self._failed[port]
+            self.pool.remove_port(port)
+
+        now = monotonic()
+        new = [p for p in sorted(ports) if p not in self.pool.ports and
+            p not in self._probing and
+            now - self._failed.get(p, now - self.retry_interval) >=
+                self.retry_interval]
+        if not new:
+            return
+        logger.info('HOTPLUG::Probing: %s' % ', '.join(new))
+        self._probing.update(new)
+        t = threading.Thread(target=self._probe, args=(new,),
+            name='hotplug-probe')
+        t.daemon = True
+        t.start()
+
+    def _probe(self, ports):
+        try:
+            self.pool.initialize(ports, open_port=self.pool.open_port,
+                cache=self.cache)
+        finally:
+            now = monotonic()
+            for port in ports:
+                self._probing.discard(port)
+                if port in self.pool.ports:
+                    self._failed.pop(port, None)
+                else:
+                    self._failed[port] = now
@@ -1,8 +1,12 @@
 import glob
 import os.path
+import threading
 import serial
 import serial.tools.list_ports
 
+import serial_gsm
+from serial_utils import monotonic
+
 
 def get_modems():
     """Returns a list of modems."""
@@ -14,3 +18,103 @@ def get_modems():
     if not modems:
         modems = [s[0] for s in serial.tools.list_ports.comports()]
     return modems
+
+
+# How long we give a port to respond before we give up on it.
+PROBE_TIMEOUT = 20
+
+PROBE_OPEN_FAILED = 'unable to load port'
+PROBE_CHECK_FAILED = 'failed to check modem'
+PROBE_NO_NUMBER = 'unable to read the sim number'
+PROBE_TIMED_OUT = 'probe timed-out'
+PROBE_DUPLICATE = 'modem already added'
+
+
+def probe_modem(port, open_port, cache=None):
+    """Opens a port and reads the number of the sim in it.
+
+    If a `SimCache` is given, the number is looked up by the sim
+    identity first and the phonebook is only scanned for sims we
+    haven't seen before.
+
+    Returns a (serial, report) tuple. The serial is None if the
+    port can't be used. The report holds the port, the number, the
+    failure reason (`error`) and how long the probe took.
+    """
+    started = monotonic()
+    report = {'port': port, 'number': None, 'error': None, 'elapsed': None}
+    ser = None
+    try:
+        ser = open_port(port)
+    except Exception as e:
+        report['error'] = '%s: %s' % (PROBE_OPEN_FAILED, e)
+    else:
+        if not serial_gsm.check_modem(ser):
+            report['error'] = PROBE_CHECK_FAILED
+        else:
+            report['number'] = _sim_number(ser, cache)
+            if not report['number']:
+                report['error'] = PROBE_NO_NUMBER
+    if report['error'] and ser is not None:
+        ser.close()
+        ser = None
+    report['elapsed'] = round(monotonic() - started, 3)
+    return ser, report
+
+
+def _sim_number(ser, cache):
+    if cache is None:
+        return serial_gsm.sim_msisdn(ser) or None
+    identity = serial_gsm.sim_identity(ser)
+    number = cache.get(identity) if identity else None
+    if number:
+        return number
+    number = serial_gsm.sim_msisdn(ser) or None
+    if number and identity:
+        cache.set(identity, number)
+    return number
+
+
+def probe_modems(ports, open_port, timeout=PROBE_TIMEOUT, cache=None):
+    """Probes all the ports at the same time. See `probe_modem()`.
+
+    Ports that haven't finished probing after `timeout` seconds are
+    reported as timed-out so a dead port can't stall the others.
+    Returns a list of (serial, report) tuples.
+    """
+    results = {}
+    lock = threading.Lock()
+    started = monotonic()
+
+    def probe(port):
+        res = probe_modem(port, open_port, cache=cache)
+        with lock:
+            if port in results:
+                # We've given up on this port already.
+                if res[0] is not None:
+                    res[0].close()
+                return
+            results[port] = res
+
+    threads = []
+    for port in ports:
+        t = threading.Thread(target=probe, args=(port,),
+            name='probe-%s' % port)
+        t.daemon = True
+        t.start()
+        threads.append(t)
+
+    deadline = started + timeout
+    for t in threads:
+        t.join(max(deadline - monotonic(), 0))
+
+    with lock:
+        for port in ports:
+            if port not in results:
+                results[port] = (None, {
+                    'port': port,
+                    'number': None,
+                    'error': PROBE_TIMED_OUT,
+                    'elapsed': round(monotonic() - started, 3),
+                })
+        return [results[port] for port in ports]
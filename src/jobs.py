@@ -0,0 +1,140 @@
+import logging
+import os
+import threading
+import time
+import uuid
+
+from serial_utils import monotonic
+
+
+logger = logging.getLogger(__name__)
+
+# How long finished jobs are kept around, in seconds.
+JOB_TTL = int(os.environ.get('GSM_JOB_TTL', 3600))
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+class UnknownJob(Exception):
+    """Raised when a job doesn't exist or has expired."""
+
+
+class Job(object):
+    """A modem operation running in the background."""
+
+    def __init__(self, number, operation, args=(), kwargs=None):
+        self.id = uuid.uuid4().hex
+        self.number = number
+        self.operation = operation
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.status = JOB_PENDING
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def is_finished(self):
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'number': self.number,
+            'operation': self.operation,
+            'status': self.status,
+            'result': self.result,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+class JobStore(object):
+    """Keeps track of jobs until `ttl` seconds after they finish."""
+
+    def __init__(self, ttl=JOB_TTL):
+        self.ttl = ttl
+        self._jobs = {}
+        self._cond = threading.Condition()
+
+    def add(self, job):
+        with self._cond:
+            self._purge()
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        """Returns a job. Raises `UnknownJob`."""
+        with self._cond:
+            self._purge()
+            try:
+                return self._jobs[job_id]
+            except KeyError:
+                raise UnknownJob(job_id)
+
+    def wait(self, job_id, timeout=0):
+        """Returns a job once it has finished or once `timeout`
+        seconds have passed, whichever comes first."""
+        deadline = monotonic() + timeout
+        with self._cond:
+            job = self.get(job_id)
+            while not job.is_finished:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+        return job
+
+    def wait_any(self, job_ids, timeout=0):
+        """Returns the jobs in `job_ids` that have finished. Waits up
+        to `timeout` seconds for at least one of them to finish."""
+        deadline = monotonic() + timeout
+        with self._cond:
+            jobs = [self.get(job_id) for job_id in job_ids]
+            while True:
+                finished = [job for job in jobs if job.is_finished]
+                remaining = deadline - monotonic()
+                if finished or remaining <= 0:
+                    return finished
+                self._cond.wait(remaining)
+
+    def run(self, job, fn, *args, **kwargs):
+        """Runs `fn(*args, **kwargs)` and records its result in
+        `job`."""
+        with self._cond:
+            job.status = JOB_RUNNING
+            job.started = time.time()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            logger.exception('JOBS::Job failed: %s' % job.id)
+            self._finish(job, JOB_FAILED, error='%s: %s' % (
+                e.__class__.__name__, e))
+        else:
+            self._finish(job, JOB_DONE, result=result)
+
+    def fail(self, job, error):
+        """Marks a job that never got to run as failed with `error`."""
+        self._finish(job, JOB_FAILED, error='%s: %s' % (
+            error.__class__.__name__, error))
+
+    def _finish(self, job, status, result=None, error=None):
+        with self._cond:
+            job.status = status
+            job.result = result
+            job.error = error
+            job.finished = time.time()
+            self._cond.notify_all()
+
+    def _purge(self):
+        expires = time.time() - self.ttl
+        for job_id, job in self._jobs.items():
+            if job.is_finished and job.finished < expires:
+                del self._jobs[job_id]
@@ -0,0 +1,150 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# Where we keep the messages we've taken off the sims.
+MESSAGE_DB_PATH = os.environ.get('GSM_MESSAGE_DB', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '.messages.db'))
+
+# How many messages we return at most by default.
+MESSAGES_LIMIT = 100
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    number TEXT NOT NULL,
+    origin TEXT,
+    date TEXT,
+    time TEXT,
+    message TEXT,
+    status TEXT,
+    received REAL NOT NULL,
+    sim_indexes TEXT,
+    on_sim INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS messages_number ON messages (number, id);
+CREATE INDEX IF NOT EXISTS messages_received ON messages (received);
+CREATE INDEX IF NOT EXISTS messages_on_sim ON messages (number, sim_indexes);
+'''
+
+# Stores made before messages were told apart by where they are on the
+# sim had every message unique by its content, which merged repeated
+# messages (eg. the same OTP twice in a second) into one.
+MIGRATE_UNIQUE_CONTENT = '''
+ALTER TABLE messages RENAME TO messages_old;
+DROP INDEX IF EXISTS messages_number;
+DROP INDEX IF EXISTS messages_received;
+DROP INDEX IF EXISTS messages_on_sim;
+%s
+INSERT INTO messages (id, number, origin, date, time, message, status,
+    received)
+SELECT id, number, origin, date, time, message, status, received
+FROM messages_old;
+DROP TABLE messages_old;
+''' % SCHEMA
+
+COLUMNS = ['id', 'number', 'origin', 'date', 'time', 'message', 'status',
+    'received']
+
+
+class MessageStore(object):
+    """Keeps the messages received by every modem, so they can be
+    taken off the sims and looked up without talking to the modems.
+
+    Messages are dictionaries like the ones `serial_gsm.inbox_messages()`
+    returns, with the modem `number` and the time we `received` them
+    instead of their index in the sim.
+    """
+
+    def __init__(self, path=MESSAGE_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        columns = [c[1] for c in
+            self._db.execute('PRAGMA table_info(messages)').fetchall()]
+        if columns and 'on_sim' not in columns:
+            logger.info('STORE::Migrating %s' % path)
+            self._db.executescript(MIGRATE_UNIQUE_CONTENT)
+        self._db.executescript(SCHEMA)
+
+    def add(self, number, m):
+        """Stores a message received by the modem `number`, as still
+        on the sim at `m['indexes']` until `removed_from_sim()` is
+        called. Returns it as stored and whether it's new.
+
+        Reading a message that's stored but still on the sim (eg. its
+        delete timed out) returns the stored copy instead. Otherwise
+        every delivery is stored, even one with the same sender, text
+        and time as another."""
+        indexes = ','.join(str(i) for i in m['indexes'])
+        with self._lock, self._db:
+            row = self._db.execute('SELECT %s FROM messages WHERE on_sim '
+                'AND number = ? AND sim_indexes = ? AND origin IS ? AND '
+                'date IS ? AND time IS ? AND message IS ?'
+                % ', '.join(COLUMNS), (number, indexes, m['origin'],
+                m['date'], m['time'], m['message'])).fetchone()
+            if row:
+                return dict(zip(COLUMNS, row)), False
+            received = time.time()
+            cur = self._db.execute('INSERT INTO messages (number, origin, '
+                'date, time, message, status, received, sim_indexes, on_sim) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1)', (number, m['origin'],
+                m['date'], m['time'], m['message'], m['status'], received,
+                indexes))
+        return dict(zip(COLUMNS, [cur.lastrowid, number, m['origin'],
+            m['date'], m['time'], m['message'], m['status'], received])), True
+
+    def removed_from_sim(self, message_id):
+        """Records that a stored message was deleted from its sim, so
+        a new message at the same index is stored on its own."""
+        with self._lock, self._db:
+            self._db.execute('UPDATE messages SET on_sim = 0 WHERE id = ?',
+                (message_id,))
+
+    def find(self, number=None, origin=None, since=None, until=None,
+            limit=MESSAGES_LIMIT, offset=0):
+        """Returns the stored messages, oldest first.
+
+        `origin` matches part of the origin regardless of case, like
+        `serial_gsm.find_sms()`. `since` and `until` are unix
+        timestamps of when we received the messages.
+        """
+        where, params = [], []
+        if number is not None:
+            where.append('number = ?')
+            params.append(number)
+        if origin:
+            where.append("LOWER(origin) LIKE ? ESCAPE '\\'")
+            params.append('%%%s%%' % origin.lower().replace('\\', '\\\\')
+                .replace('%', '\\%').replace('_', '\\_'))
+        if since is not None:
+            where.append('received >= ?')
+            params.append(since)
+        if until is not None:
+            where.append('received < ?')
+            params.append(until)
+        sql = 'SELECT %s FROM messages' % ', '.join(COLUMNS)
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY id LIMIT ? OFFSET ?'
+        with self._lock:
+            rows = self._db.execute(sql, params + [limit, offset]).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def version(self, number):
+        """Returns a string that changes whenever messages of the
+        modem `number` are added or deleted. Ids are never reused."""
+        with self._lock:
+            count, last_id = self._db.execute('SELECT COUNT(*), MAX(id) '
+                'FROM messages WHERE number = ?', (number,)).fetchone()
+        return '%s.%s' % (count, last_id or 0)
+
+    def delete(self, number):
+        """Deletes every message of the modem `number`."""
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM messages WHERE number = ?', (number,))
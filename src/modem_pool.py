@@ -0,0 +1,695 @@
+import logging
+import threading
+import Queue
+from functools import partial
+
+import serial
+
+import breaker
+import events
+import health
+import initialize
+import jobs
+import message_store
+import net_utils
+import pacing
+import ppp
+import routing
+import serial_reactor
+import serial_gsm
+import sms_pdu
+import ussd_cache
+from modem_worker import ModemWorker, Task, TaskExpired, PRIORITIES, \
+    PRIORITY_BATCH, PRIORITY_INTERACTIVE, PRIORITY_NORMAL
+from serial_urc import URCSerial
+from serial_utils import monotonic
+
+
+logger = logging.getLogger(__name__)
+
+
+SERIAL_BAUDRATE = 115200
+SERIAL_TIMEOUT = 0.1
+Serial = partial(serial.Serial, baudrate=SERIAL_BAUDRATE,
+    timeout=SERIAL_TIMEOUT)
+
+
+# Operations that can be run on a modem's worker, by name. Each one
+# is called as `fn(ser, *args, **kwargs)`.
+OPERATIONS = {
+    'call': serial_gsm.call,
+    'answer_call': serial_gsm.answer_call,
+    'send_sms': serial_gsm.send_sms,
+    'inbox_messages': serial_gsm.inbox_messages,
+    'delete_inbox_messages': serial_gsm.delete_inbox_messages,
+    'storage_status': serial_gsm.storage_status,
+    'find_sms': serial_gsm.find_sms,
+    'ussd_send': serial_gsm.ussd_send,
+    'check_signal': serial_gsm.check_signal,
+    'data_request': net_utils.data_request,
+    'ftp_request': net_utils.ftp_request,
+}
+
+
+# Operations that are paced per modem. See `pacing.SendPacer`.
+PACED_OPERATIONS = ['send_sms']
+
+
+# How long `wait_for_sms()` waits for events at a time when it
+# waits forever.
+SMS_WAIT_INTERVAL = 60
+
+
+# How long a modem has to answer a test command after each recovery
+# step before we try the next one.
+RECOVERY_CHECK_TIMEOUT = 2
+
+
+# Pool methods that can be run as jobs, besides `OPERATIONS`. They
+# use the modem's worker themselves.
+POOL_OPERATIONS = ['wait_for_sms', 'wait_for_call', 'ussd']
+# Pool operations that take a `priority` and `deadline` for the work
+# they queue on the worker. `wait_for_sms` never uses the modem.
+SCHEDULED_POOL_OPERATIONS = ['wait_for_call', 'ussd']
+
+
+class UnknownModem(Exception):
+    """Raised when there's no modem with the given number."""
+
+
+class UnknownOperation(Exception):
+    """Raised when an operation isn't in `OPERATIONS`."""
+
+
+def scheduling(kwargs):
+    """Pops the `priority` and `deadline` of an operation out of its
+    keyword arguments and returns them as `Task` arguments.
+
+    `priority` is one of `PRIORITIES` (by name or value) and defaults
+    to normal. `deadline` is how many seconds the operation may wait
+    for the modem before it's dropped, or None to wait forever.
+    """
+    priority = kwargs.pop('priority', None)
+    priority = PRIORITIES.get(priority, priority)
+    if priority not in PRIORITIES.values():
+        priority = PRIORITY_NORMAL
+    deadline = kwargs.pop('deadline', None)
+    return {
+        'priority': priority,
+        'deadline': monotonic() + deadline if deadline else None,
+    }
+
+
+def _refund_if_refused(pacer, fn, ser, *args, **kwargs):
+    """Runs the paced operation `fn`, giving its token back to the
+    pacer if the modem's circuit opened before it could run."""
+    try:
+        return fn(ser, *args, **kwargs)
+    except breaker.CircuitOpen:
+        pacer.release()
+        raise
+
+
+def _refund_on_expire(pacer, on_expire, error):
+    pacer.release()
+    if on_expire:
+        on_expire(error)
+
+
+class ModemPool(object):
+    """Keeps track of the connected modems and the worker that owns
+    each modem's serial port."""
+
+    def __init__(self, store=None):
+        self.ports = {}  # port -> number
+        self.numbers = {}  # number -> port
+        self.workers = {}  # number -> ModemWorker
+        self.pacers = {}  # number -> pacing.SendPacer
+        self.breakers = {}  # number -> breaker.CircuitBreaker
+        # How we open ports again to recover modems.
+        self.open_port = Serial
+        self.ussd_cache = ussd_cache.USSDCache()
+        # Reads every port from a single thread.
+        self.reactor = serial_reactor.Reactor()
+        self.reactor.start()
+        self.health = health.HealthSampler(self)
+        self.health.start()
+        self.unused = []
+        self.probe_reports = []  # See `initialize.probe_modems()`.
+        self.jobs = jobs.JobStore()
+        self.events = events.EventLog()
+        # Received messages are moved off the sims into the store.
+        self.store = store or message_store.MessageStore()
+
+    def initialize(self, ports, open_port=Serial, cache=None):
+        """Probes all the ports at the same time and adds every
+        modem we got a number from. Can be called again for ports
+        that show up later (see `hotplug.PortWatcher`)."""
+        self.open_port = open_port
+        for ser, report in initialize.probe_modems(ports, open_port,
+                cache=cache):
+            port = report['port']
+            if ser is not None and report['number'] in self.workers:
+                # Never replace a modem that's already in use.
+                ser.close()
+                ser = None
+                report['error'] = initialize.PROBE_DUPLICATE
+            logger.info('POOL::Probe: port=%(port)s number=%(number)s '
+                'error=%(error)s elapsed=%(elapsed)ss' % report)
+            self.probe_reports = [r for r in self.probe_reports
+                if r['port'] != port] + [report]
+            if port in self.unused:
+                self.unused.remove(port)
+            if ser is None:
+                if report['error'].startswith(initialize.PROBE_OPEN_FAILED):
+                    self.unused.append(port)
+                continue
+            self.add(report['number'], port, ser)
+
+    def remove_port(self, port):
+        """Forgets a port that's gone, and retires its modem if it
+        had one. See `remove()`."""
+        if port in self.unused:
+            self.unused.remove(port)
+        self.probe_reports = [r for r in self.probe_reports
+            if r['port'] != port]
+        number = self.ports.get(port, None)
+        if number is not None:
+            self.remove(number)
+
+    def remove(self, number):
+        """Retires a modem that's gone (eg. unplugged). Work queued
+        for it fails with `TaskExpired` and its port is closed. The
+        other modems aren't affected."""
+        worker = self.workers.pop(number, None)
+        if worker is None:
+            return
+        self.ports.pop(self.numbers.pop(number, None), None)
+        worker.stop(TaskExpired('Modem %s was removed.' % number))
+        try:
+            worker.ser.close()
+        except Exception:
+            logger.exception('POOL::Unable to close the port of %s' % number)
+        self.health.forget(number)
+        logger.info('POOL::Removed: %s' % number)
+
+    def add(self, number, port, ser):
+        """Registers a modem and starts its worker.
+
+        The port is wrapped in a `URCSerial` so unsolicited result
+        codes (new messages, incoming calls) get published as they
+        arrive. It's read by the pool's reactor along with every
+        other port.
+        """
+        ser = URCSerial(ser).start(self.reactor)
+        worker = ModemWorker(number, ser)
+        worker.start()
+        worker.submit(serial_gsm.enable_notifications)
+        worker.submit(self._sync_messages, number)
+        # Learn the operator of the sim right away for routing.
+        worker.submit(self.health.record, number)
+        ser.subscribe(partial(self._on_urc, number))
+        self.pacers[number] = pacing.SendPacer()
+        self.breakers[number] = breaker.CircuitBreaker(number,
+            on_open=partial(self._start_recovery, number))
+        self.workers[number] = worker
+        self.ports[port] = number
+        self.numbers[number] = port
+        return worker
+
+    def _on_urc(self, number, urc):
+        """Turns the URCs of a modem into events. Runs on the reader
+        thread of the modem's port."""
+        if urc['type'] == 'CMTI':
+            # Read the new message on the worker. Only the index
+            # is pushed to us.
+            self.workers[number].submit(self._receive_message, number,
+                urc['index'])
+        elif urc['type'] == 'RING':
+            self.events.publish({'type': events.EVENT_RING, 'number': number})
+        elif urc['type'] == 'NO CARRIER':
+            self.events.publish({'type': events.EVENT_HANGUP, 'number': number})
+        elif urc['type'] == 'CDS':
+            self.events.publish({'type': events.EVENT_STATUS_REPORT,
+                'number': number, 'data': urc['data']})
+
+    def _receive_message(self, ser, number, index):
+        try:
+            m = serial_gsm.read_message(ser, index)
+        except serial_gsm.ModemTimeout as e:
+            self._record_timeout(number, e)
+            return
+        if not m:
+            return
+        # Parts of concatenated messages stay on the sim until all the
+        # parts have arrived. Since the sim only holds messages we
+        # haven't stored yet, reading all of it is cheap.
+        if m['concat']:
+            self._sync_messages(ser, number)
+        else:
+            self._store_message(ser, number, sms_pdu.merge_parts([m])[0])
+
+    def _sync_messages(self, ser, number):
+        """Moves the complete messages on the sim to the store."""
+        try:
+            messages = serial_gsm.inbox_messages(ser)
+        except serial_gsm.ModemTimeout as e:
+            self._record_timeout(number, e)
+            return
+        for m in messages:
+            if m['complete']:
+                self._store_message(ser, number, m)
+
+    def _record_timeout(self, number, e):
+        """Counts a command the modem didn't answer outside of an
+        operation (eg. reading a new message) as a failure."""
+        logger.warning('POOL::%s timed out: %s' % (number, e))
+        if number in self.breakers:
+            self.breakers[number].record(False, str(e))
+
+    def _store_message(self, ser, number, m):
+        stored, added = self.store.add(number, m)
+        # Only delete the message from the sim once it's stored. If
+        # that fails, it's stored again only once it's been deleted.
+        deleted = [serial_gsm.delete_inbox_message(ser, index)
+            for index in m['indexes']]
+        if all(deleted):
+            self.store.removed_from_sim(stored['id'])
+        if added:
+            self.events.publish({'type': events.EVENT_SMS, 'number': number,
+                'message': stored})
+
+    def available_numbers(self):
+        return self.workers.keys()
+
+    def unused_ports(self):
+        return self.unused
+
+    def probes(self):
+        return self.probe_reports
+
+    def pacing(self):
+        """Returns how fast each modem is currently allowed to send
+        messages. See `pacing.SendPacer`."""
+        return dict((number, self.pacers[number].to_dict())
+            for number in self.workers.keys())
+
+    def interfaces(self):
+        """Returns the ppp interface of each modem that's dialed up
+        (see `ppp.PPPManager`)."""
+        return dict((self.ports[port], session)
+            for port, session in ppp.sessions.sessions().items()
+            if port in self.ports)
+
+    def circuits(self):
+        """Returns the circuit breaker state of each modem. See
+        `breaker.CircuitBreaker`."""
+        return dict((number, self.breakers[number].to_dict())
+            for number in self.workers.keys())
+
+    def _start_recovery(self, number):
+        if number not in self.workers:
+            # Removed since.
+            return
+        # Goes ahead of anything queued. Queued operations fail right
+        # away while the circuit is open.
+        self.worker(number).put(Task(self._recover, (number,),
+            priority=PRIORITY_INTERACTIVE))
+
+    def _recover(self, ser, number):
+        """Tries to bring back a modem whose circuit is open: resets
+        it, then restarts its radio, then reopens its port, until it
+        responds again. Tries again later if nothing works."""
+        circuit = self.breakers[number]
+        circuit.recovering()
+        steps = [
+            ('reset', serial_gsm.soft_reset),
+            ('restart radio', serial_gsm.restart_radio),
+            ('reopen port', lambda ser: ser.reopen(self.open_port)),
+        ]
+        for name, step in steps:
+            logger.info('POOL::Recovering %s: %s' % (number, name))
+            try:
+                step(ser)
+                ser.flushInput()
+                if serial_gsm.check_modem(ser, timeout=RECOVERY_CHECK_TIMEOUT):
+                    serial_gsm.reset_state(ser)
+                    circuit.close()
+                    return True
+            except Exception:
+                logger.exception('POOL::Recovery failed: %s %s' % (
+                    number, name))
+        circuit.fail_recovery()
+        t = threading.Timer(breaker.BREAKER_RETRY_INTERVAL,
+            self._start_recovery, (number,))
+        t.daemon = True
+        t.start()
+        return False
+
+    def health_report(self):
+        """Returns the latest signal quality, registration status and
+        operator of each modem (see `health.HealthSampler`) along
+        with how many operations are waiting for it."""
+        report = {}
+        for number, worker in self.workers.items():
+            report[number] = {
+                'health': self.health.summary(number),
+                'carrier': self.carrier(number),
+                'circuit': self.breakers[number].state,
+                'pending': worker.pending(),
+            }
+        return report
+
+    def carrier(self, number):
+        """Returns the carrier of the sim in a modem, as learned from
+        the operator it's on (see `routing.carrier_of_operator()`)."""
+        summary = self.health.summary(number) or {}
+        return routing.carrier_of_operator(summary.get('operator', None))
+
+    def pick(self, numbers=None, carrier=None, destination=None):
+        """Returns the number of the best modem to use out of
+        `numbers` (or all the modems): one that's registered to the
+        network, has the least operations waiting and then the best
+        signal. Modems we haven't sampled yet count as registered.
+        Modems whose circuit is open are left out.
+
+        Only modems on `carrier` (in any case) are used if it's set.
+        Modems on the same network as the `destination` number are
+        preferred.
+        """
+        numbers = [n for n in numbers or self.available_numbers()
+            if self.breakers[n].allow()]
+        if carrier:
+            carrier = carrier.lower()
+            numbers = [n for n in numbers if self.carrier(n) == carrier]
+            if not numbers:
+                raise UnknownModem('No modems on %s.' % carrier)
+        elif destination:
+            carrier = routing.carrier_of_number(destination)
+            on_net = [n for n in numbers if carrier and
+                self.carrier(n) == carrier]
+            numbers = on_net or numbers
+        if not numbers:
+            raise UnknownModem('No modems available.')
+
+        def score(number):
+            summary = self.health.summary(number) or {}
+            return (
+                not summary.get('registered', True),
+                self.worker(number).pending(),
+                -(summary.get('rssi_avg', None) or 0),
+            )
+        return min(numbers, key=score)
+
+    def worker(self, number):
+        """Returns the worker of a modem. Raises `UnknownModem`."""
+        try:
+            return self.workers[number]
+        except KeyError:
+            raise UnknownModem(number)
+
+    def operation(self, number, op):
+        """Returns the function of the operation named `op` for a
+        modem. Sends are paced, and failures counted by the modem's
+        circuit breaker."""
+        try:
+            fn = OPERATIONS[op]
+        except KeyError:
+            raise UnknownOperation(op)
+        if op in PACED_OPERATIONS:
+            fn = partial(self.pacers[number].run, fn)
+        # Modems that keep failing stop taking work until they're
+        # recovered.
+        fn = partial(self.breakers[number].run, fn)
+        if op in PACED_OPERATIONS:
+            fn = partial(_refund_if_refused, self.pacers[number], fn)
+        return fn
+
+    def submit(self, number, op, *args, **kwargs):
+        """Queues the operation named `op` on the modem's worker.
+        Returns a `Task`.
+
+        The `priority` and `deadline` keyword arguments are taken by
+        the worker (see `scheduling()`) and not passed to the
+        operation. Raises `breaker.CircuitOpen` right away if the
+        modem's circuit is open.
+        """
+        self.worker(number)
+        self.breakers[number].check()
+        task = Task(self.operation(number, op), args, kwargs, name=op,
+            **scheduling(kwargs))
+        return self._put(number, op, task)
+
+    def _put(self, number, op, task):
+        """Queues the task of the operation `op` on the modem's worker.
+        Paced operations are only queued once the pacer allows them,
+        so the worker never sleeps waiting for the pacer. Returns the
+        task."""
+        worker = self.worker(number)
+        wait = 0
+        if op in PACED_OPERATIONS:
+            pacer = self.pacers[number]
+            wait = pacer.reserve()
+            # Sends dropped before they run (past their deadline, or
+            # the modem was removed) give their token back.
+            task.on_expire = partial(_refund_on_expire, pacer,
+                task.on_expire)
+        if not wait:
+            return worker.put(task)
+        t = threading.Timer(wait, self._put_later, (number, task))
+        t.daemon = True
+        t.start()
+        return task
+
+    def _put_later(self, number, task):
+        if number not in self.workers:
+            task.expire(TaskExpired('Modem %s was removed.' % number))
+            return
+        self.workers[number].put(task)
+
+    def run(self, number, op, *args, **kwargs):
+        """Same as `submit()` but blocks until we get a result."""
+        return self.submit(number, op, *args, **kwargs).wait()
+
+    def messages(self, number, origin=None, since=None, until=None,
+            limit=message_store.MESSAGES_LIMIT, offset=0):
+        """Returns the messages received by a modem, oldest first. See
+        `message_store.MessageStore.find()`."""
+        self.worker(number)
+        return self.store.find(number, origin=origin, since=since,
+            until=until, limit=limit, offset=offset)
+
+    def inbox_version(self, number):
+        """Returns a string that changes whenever the messages of a
+        modem change. See `message_store.MessageStore.version()`."""
+        self.worker(number)
+        return self.store.version(number)
+
+    def clear_inbox(self, number):
+        """Deletes the messages of a modem, both stored and on the sim."""
+        res = self.run(number, 'delete_inbox_messages')
+        self.store.delete(number)
+        return res
+
+    def storage(self, numbers=None):
+        """Returns how full the message storage of each modem is (see
+        `serial_gsm.storage_status()`). Asks all the modems at the
+        same time. Without `numbers`, modems whose circuit is open are
+        left out instead of failing the lot."""
+        numbers = numbers or [n for n in self.available_numbers()
+            if self.breakers[n].allow()]
+        tasks = [(n, self.submit(n, 'storage_status')) for n in numbers]
+        return dict((n, task.wait()) for n, task in tasks)
+
+    def ussd(self, number, command, timeout=0,
+            max_age=ussd_cache.USSD_CACHE_TTL, priority=None, deadline=None):
+        """Sends a USSD command (see `serial_gsm.ussd_send()`).
+
+        Reuses a response at most `max_age` seconds old. The same
+        command sent at the same time on the same modem only starts a
+        single USSD session, whose response all the callers get.
+        """
+        self.worker(number)
+        return self.ussd_cache.get(number, command, lambda: self.submit(
+            number, 'ussd_send', command, timeout=timeout, priority=priority,
+            deadline=deadline), max_age=max_age)
+
+    def wait_for_sms(self, number, origin, timeout=0):
+        """Waits for a message from a specific origin.
+
+        Looks for the message in the store, then waits for it to
+        arrive. The modem isn't used at all.
+        """
+        self.worker(number)
+        after = self.events.last_id()
+        found = self.store.find(number, origin=origin, limit=1)
+        if found:
+            return {'message': found[0], 'error': None}
+        started = monotonic()
+        while True:
+            remaining = SMS_WAIT_INTERVAL
+            if timeout:
+                remaining = timeout - (monotonic() - started)
+                if remaining <= 0:
+                    return {'message': None, 'error': 'Wait for SMS timed-out.'}
+            received = self.events.since(after, remaining, number=number,
+                types=[events.EVENT_SMS], origin=origin)
+            if received:
+                return {'message': received[0]['message'], 'error': None}
+
+    def wait_for_call(self, number, duration=0, timeout=30, priority=None,
+            deadline=None):
+        """Waits for an incoming call (RING) and answers it on the
+        modem's worker. See `serial_gsm.wait_and_answer_call()`.
+
+        The `deadline` only counts once the call comes in.
+        """
+        worker = self.worker(number)
+        self.breakers[number].check()
+        sub = worker.ser.listen(['RING'])
+        try:
+            if not sub.get(timeout):
+                return {'connected': False, 'duration': 0}
+        finally:
+            sub.close()
+        return worker.put(Task(serial_gsm.answer_call,
+            kwargs={'duration': duration, 'timeout': timeout},
+            **scheduling({'priority': priority, 'deadline': deadline}))).wait()
+
+    def submit_job(self, number, op, *args, **kwargs):
+        """Starts the operation named `op` in the background. Returns
+        the job (as a dictionary) right away. See `job()`."""
+        worker = self.worker(number)
+        if op not in OPERATIONS and op not in POOL_OPERATIONS:
+            raise UnknownOperation(op)
+        job = self.jobs.add(jobs.Job(number, op, args, kwargs))
+        if op in POOL_OPERATIONS:
+            if op not in SCHEDULED_POOL_OPERATIONS:
+                # It has no use for them.
+                scheduling(kwargs)
+            t = threading.Thread(target=self.jobs.run, name='job-%s' % job.id,
+                args=(job, getattr(self, op), number) + args, kwargs=kwargs)
+            t.daemon = True
+            t.start()
+        else:
+            fn = self.operation(number, op)
+            # Jobs dropped for missing their deadline fail right away.
+            self._put(number, op, Task(lambda ser: self.jobs.run(job, fn,
+                ser, *args, **kwargs), on_expire=partial(self.jobs.fail, job),
+                name=op, **scheduling(kwargs)))
+        return job.to_dict()
+
+    def send_bulk(self, messages, numbers=None):
+        """Sends many messages at once, spread across the modems.
+
+        `messages` is a list of dictionaries with the recipient
+        `number` and the `message`, and optionally the `sender` modem
+        to use. Messages without a sender go out through any of the
+        modems in `numbers`, or any modem at all, preferably one on
+        the same network as the recipient. Returns a `send_sms` job
+        (as a dictionary) for each message, in order.
+        """
+        numbers = numbers or self.available_numbers()
+        for number in numbers:
+            self.worker(number)
+        for m in messages:
+            if m.get('sender', None):
+                self.worker(m['sender'])
+            elif not numbers:
+                raise UnknownModem('No modems available.')
+
+        unassigned = {}  # carrier -> Queue of jobs
+        results = []
+        for m in messages:
+            job = self.jobs.add(jobs.Job(m.get('sender', None), 'send_sms',
+                (m['number'], m['message'])))
+            if job.number:
+                self._put(job.number, 'send_sms', Task(partial(self.jobs.run,
+                    job, self.operation(job.number, 'send_sms')), job.args,
+                    on_expire=partial(self.jobs.fail, job),
+                    priority=PRIORITY_BATCH))
+            else:
+                carrier = routing.carrier_of_number(m['number'])
+                unassigned.setdefault(carrier, Queue.Queue()).put(job)
+            results.append(job.to_dict())
+
+        # Every modem takes the next message once it's done with its
+        # last one, so faster modems end up sending more. Messages are
+        # sent in the background: anything else queued on the modem
+        # goes first.
+        count = sum(q.qsize() for q in unassigned.values())
+        for number in numbers[:count]:
+            self._queue_next_send(number, unassigned)
+        return results
+
+    def _queue_next_send(self, number, unassigned, reserved=False):
+        if number not in self.workers:
+            # Removed since. The other modems send its messages.
+            if reserved:
+                self.pacers[number].release()
+            return
+        self.worker(number).put(Task(self._send_next,
+            (number, unassigned, reserved), priority=PRIORITY_BATCH))
+
+    def _send_next(self, ser, number, unassigned, reserved=False):
+        # Modems being recovered leave the messages to the others
+        # until they're back.
+        wait = None
+        if not self.breakers[number].allow():
+            if reserved:
+                self.pacers[number].release()
+            wait, reserved = breaker.BREAKER_RETRY_INTERVAL, False
+        elif not reserved:
+            wait, reserved = self.pacers[number].reserve(), True
+        # Wait for the pacer off the worker so other work doesn't
+        # queue up behind the wait.
+        if wait:
+            t = threading.Timer(wait, self._queue_next_send,
+                (number, unassigned, reserved))
+            t.daemon = True
+            t.start()
+            return
+
+        # Messages to the modem's own network go first.
+        own = self.carrier(number)
+        job = None
+        for carrier in [own] + [c for c in unassigned if c != own]:
+            try:
+                job = unassigned[carrier].get_nowait()
+                break
+            except (KeyError, Queue.Empty):
+                continue
+        if job is None:
+            self.pacers[number].release()
+            return
+        job.number = number
+        self.jobs.run(job, self.operation(number, 'send_sms'), ser, *job.args)
+        if any(not q.empty() for q in unassigned.values()):
+            self._queue_next_send(number, unassigned)
+
+    def job(self, job_id, wait=0):
+        """Returns a job as a dictionary. If `wait` is set, waits up
+        to `wait` seconds for the job to finish first. Raises
+        `jobs.UnknownJob`."""
+        if wait:
+            return self.jobs.wait(job_id, wait).to_dict()
+        return self.jobs.get(job_id).to_dict()
+
+    def finished_jobs(self, job_ids, wait=0):
+        """Returns the jobs in `job_ids` that have finished, as
+        dictionaries. If `wait` is set, waits up to `wait` seconds for
+        at least one of them to finish."""
+        return [job.to_dict() for job in self.jobs.wait_any(job_ids, wait)]
+
+    def last_event_id(self):
+        return self.events.last_id()
+
+    def events_since(self, after=0, timeout=0, number=None, types=None,
+            origin=None):
+        """Returns the modem events (incoming messages, calls and
+        hangups) after the event id `after`, waiting up to `timeout`
+        seconds for one. See `events.matches()` for the filters."""
+        if number is not None:
+            self.worker(number)
+        return self.events.since(after, timeout, number=number,
+            types=types, origin=origin)
@@ -0,0 +1,173 @@
+import itertools
+import logging
+import sys
+import threading
+import Queue
+
+from serial_utils import monotonic
+
+
+logger = logging.getLogger(__name__)
+
+# Priority classes of tasks. Lower goes first: interactive requests
+# (eg. a balance check from a console) jump ahead of background work
+# like bulk sends.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BATCH = 2
+PRIORITIES = {
+    'interactive': PRIORITY_INTERACTIVE,
+    'normal': PRIORITY_NORMAL,
+    'batch': PRIORITY_BATCH,
+}
+
+
+class TaskExpired(Exception):
+    """Raised when a task's deadline passes before it gets to run."""
+
+
+class Task(object):
+    """A unit of work executed by a `ModemWorker`.
+
+    The callable is invoked as `fn(ser, *args, **kwargs)` on the
+    worker thread. Callers block on `wait()` until it's done.
+
+    A task with a `deadline` (in `monotonic()` time) is dropped if it
+    hasn't started by then, without ever touching the port.
+    `on_expire` is then called with the `TaskExpired` error.
+    """
+
+    def __init__(self, fn, args=(), kwargs=None, priority=PRIORITY_NORMAL,
+            deadline=None, on_expire=None, name=None):
+        self.fn = fn
+        self.name = name or getattr(fn, '__name__', repr(fn))
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.priority = priority
+        self.deadline = deadline
+        self.on_expire = on_expire
+        self._lock = threading.Lock()
+        self._started = False
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def _start(self):
+        """Returns whether the task should run, expiring it if its
+        deadline has passed."""
+        if self.deadline is not None and monotonic() >= self.deadline:
+            self.expire()
+        with self._lock:
+            if self._done.is_set():
+                return False
+            self._started = True
+            return True
+
+    def expire(self, error=None):
+        """Drops the task if it hasn't started yet, failing it with
+        `error` (a `TaskExpired`). Returns whether it was dropped."""
+        with self._lock:
+            if self._started or self._done.is_set():
+                return False
+            self._error = error or TaskExpired(
+                'Not started before its deadline: %s' % self.name)
+            self._done.set()
+        logger.info('WORKER::%s' % self._error)
+        if self.on_expire:
+            self.on_expire(self._error)
+        return True
+
+    def run(self, ser):
+        if not self._start():
+            return
+        try:
+            self._result = self.fn(ser, *self.args, **self.kwargs)
+        except Exception as e:
+            logger.exception('WORKER::Task failed: %s' % self.fn)
+            self._error = e
+        finally:
+            self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Blocks until the task has been executed and returns its
+        result. Exceptions raised by the task are re-raised here.
+
+        Waits at most until the deadline for the task to start, and
+        raises `TaskExpired` if it doesn't.
+        """
+        started = monotonic()
+        if self.deadline is not None:
+            self._done.wait(max(self.deadline - monotonic(), 0))
+            self.expire()
+        if timeout is not None:
+            timeout = max(timeout - (monotonic() - started), 0)
+        self._done.wait(timeout)
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class ModemWorker(threading.Thread):
+    """Owns a single serial port and executes tasks against it one
+    at a time, by priority and then in the order they were submitted.
+
+    Every modem gets its own worker so modems run in parallel while
+    commands to a single modem never interleave.
+    """
+
+    def __init__(self, number, ser):
+        super(ModemWorker, self).__init__(name='modem-%s' % number)
+        self.daemon = True
+        self.number = number
+        self.ser = ser
+        # Holds (priority, sequence, task) so tasks of the same
+        # priority keep their order.
+        self._queue = Queue.PriorityQueue()
+        self._sequence = itertools.count()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queues `fn(ser, *args, **kwargs)`. Returns a `Task`."""
+        return self.put(Task(fn, args, kwargs))
+
+    def put(self, task):
+        """Queues a `Task` behind the tasks of the same or a higher
+        priority. Returns the task."""
+        self._queue.put((task.priority, next(self._sequence), task))
+        return task
+
+    def pending(self):
+        """Returns the number of tasks waiting to be executed."""
+        return self._queue.qsize()
+
+    def stop(self, error=None):
+        """Stops once everything queued before has run. If an `error`
+        (a `TaskExpired`) is given, stops after the current task
+        instead and fails the queued ones with it."""
+        if error is None:
+            self._queue.put((sys.maxint, next(self._sequence), None))
+        else:
+            self._queue.put((-1, next(self._sequence), error))
+
+    def run(self):
+        while True:
+            _, _, task = self._queue.get()
+            if task is None:
+                logger.debug('WORKER::Stopped: %s' % self.number)
+                return
+            if isinstance(task, TaskExpired):
+                self._drop(task)
+                logger.debug('WORKER::Stopped: %s' % self.number)
+                return
+            task.run(self.ser)
+
+    def _drop(self, error):
+        while True:
+            try:
+                _, _, task = self._queue.get_nowait()
+            except Queue.Empty:
+                return
+            if isinstance(task, Task):
+                task.expire(error)
@@ -1,25 +1,50 @@
-from mock import patch
+from StringIO import StringIO
 from contextlib import contextmanager
 import serial_gsm
+import serial_urc
 import urllib2
+import base64
 import socket
+import threading
 import time
 import requests
 import fcntl
 import struct
 import socket
 import subprocess
+import ftp_utils
+import ppp
 
 
 true_socket = socket.socket
 
+# Not every python exposes it. This is its value on linux.
+SO_BINDTODEVICE = getattr(socket, 'SO_BINDTODEVICE', 25)
 
-def make_bound_socket(ip):
-    def bound_socket(*a, **k):
-        sock = true_socket(*a, **k)
-        sock.bind((ip, 0))
-        return sock
-    return bound_socket
+# How often we check whether a dial-up session is up.
+CONNECT_POLL_INTERVAL = 0.5
+
+# The interface sockets created by the current thread go through. See
+# `use_interface()`.
+_bound = threading.local()
+# How many threads are using an interface, and the lock around it.
+_bound_users = [0]
+_bound_lock = threading.Lock()
+
+
+def bound_socket(*a, **k):
+    """Creates a socket that goes through the interface the current
+    thread uses, if any."""
+    sock = true_socket(*a, **k)
+    interface = getattr(_bound, 'interface', None)
+    if interface and sock.family == socket.AF_INET:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_BINDTODEVICE,
+                interface + '\0')
+        except socket.error, e:
+            print 'unable to bind to %s: %s' % (interface, e)
+        sock.bind((_bound.ip, 0))
+    return sock
 
 
 def get_ip_address(ifname):
@@ -35,43 +60,211 @@ def get_ip_address(ifname):
 
 @contextmanager
 def use_interface(interface):
+    """Sends the traffic of the current thread through `interface`,
+    without touching the routes or the traffic of other threads. So
+    several threads can each use their own interface at once."""
     interface_ip = get_ip_address(interface)
-    set_default_gateway(interface_ip)
-    mock_socket = make_bound_socket(interface_ip)
-    with patch('socket.socket', mock_socket):
+    with _bound_lock:
+        if not _bound_users[0]:
+            socket.socket = bound_socket
+        _bound_users[0] += 1
+    _bound.interface, _bound.ip = interface, interface_ip
+    try:
         yield
+    finally:
+        _bound.interface = _bound.ip = None
+        with _bound_lock:
+            _bound_users[0] -= 1
+            if not _bound_users[0]:
+                socket.socket = true_socket
 
 
 def _join_overrides(d):
     return ['%s=%s' % (k, v) for k, v in d.iteritems()]
 
 
-def check_if_connected(interface):
-    try:
-        print "checking interface..."
-        get_ip_address(interface)
+def check_if_connected(interface, wait_connect=0):
+    """Checks whether `interface` is up, waiting up to `wait_connect`
+    seconds for it."""
+    print "checking interface %s..." % interface
+    deadline = time.time() + wait_connect
+    while True:
+        try:
+            get_ip_address(interface)
+        except IOError, e:
+            if time.time() < deadline:
+                time.sleep(CONNECT_POLL_INTERVAL)
+                continue
+            err = "Error! Failed to connect to %s. Reason: %s" % (interface, e)
+            return (False, err)
         print "interface ok!"
-    except IOError, e:
-        err = "Error! Failed to connect to %s. Reason: %s" % (interface, e)
-        return (False, err)
-    return (True, None)
+        return (True, None)
 
 
-def connect_wvdial(port, apn, dial='*99#', wait_connect=5):
+def connect_wvdial(port, apn, unit, dial='*99#'):
+    """Dials up the modem on `port`. pppd brings the session up as
+    `ppp<unit>` and leaves the default route alone, since requests
+    are bound to the interface instead (see `use_interface()`)."""
     print "connecting wvdial..."
     overrides = {
         'Phone': dial,
         'Init3': 'AT+CGDCONT=1,"IP","%s","",0,0' % apn,
         'Modem': port,
+        'PPPD Options': 'unit %d nodefaultroute' % unit,
     }
     base_cmd = ['wvdial']
     cmd = base_cmd + _join_overrides(overrides)
     print base_cmd
     p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    time.sleep(wait_connect)
     return p
 
 
+def data_request(ser, url, apn, timeout=0, wait_connect=5,
+        refresh_dns=False):
+    """Dials up the modem that owns `ser` and requests `url`
+    through it. `connected` in the response tells whether the modem
+    got connected at all."""
+    if refresh_dns:
+        flush_dns()
+    # wvdial needs the port to itself.
+    with serial_urc.paused(ser):
+        res = _data_request(ser.port, url, apn, timeout=timeout,
+            wait_connect=wait_connect)
+    # wvdial resets the modem.
+    serial_gsm.reset_state(ser)
+    return res
+
+
+def _data_request(port, url, apn, timeout=0, wait_connect=5):
+    # Every modem dials up on an interface of its own.
+    with ppp.sessions.session(port) as unit:
+        res = _data_request_on(port, ppp.interface_name(unit), unit, url,
+            apn, timeout=timeout, wait_connect=wait_connect)
+    return res
+
+
+def _data_request_on(port, interface, unit, url, apn, timeout=0,
+        wait_connect=5):
+    proc = connect_wvdial(port, apn, unit)
+    res, err = check_if_connected(interface, wait_connect)
+
+    if not res:
+        proc.terminate()
+        return {
+            'interface': interface,
+            'error': 'Unable to establish a connection to the network: %s. Try increasing the `wait_connect` parameter.' % err,
+            'url': url,
+            'response_body_size': None,
+            'response_header_size': None,
+            'response_status_code': None,
+            'connected': False,
+        }
+
+    with use_interface(interface):
+        try:
+            r = requests.get(url, timeout=timeout)
+        except requests.ConnectionError:
+            proc.terminate()
+            return {
+                'interface': interface,
+                'error': 'Request timed-out. Unable to connect to the url specified. Try increasing the `timeout` parameter.',
+                'url': url,
+                'response_body_size': None,
+                'response_header_size': None,
+                'response_status_code': None,
+                'connected': True,
+            }
+
+    # Let's close the interface, finally.
+    proc.terminate()
+
+    return {
+        'interface': interface,
+        'error': None,
+        'url': url,
+        'response_body_size': len(r.text),
+        'response_header_size': None,
+        'response_status_code': r.status_code,
+        'connected': True,
+    }
+
+
+def ftp_request(ser, ftp_data, ftp_host, apn, ftp_filename='tmp',
+        ftp_path='/tmp', ftp_port=21, ftp_username=None, ftp_password=None,
+        timeout=0, wait_connect=5, refresh_dns=False):
+    """Dials up the modem that owns `ser` and uploads the base64
+    encoded `ftp_data` through it. `connected` in the response tells
+    whether the modem got connected at all."""
+    if refresh_dns:
+        flush_dns()
+    ftp_file = StringIO(base64.b64decode(ftp_data))
+    # wvdial needs the port to itself.
+    with serial_urc.paused(ser):
+        res = _ftp_request(ser.port, ftp_file, ftp_host, apn,
+            ftp_filename=ftp_filename, ftp_path=ftp_path,
+            ftp_port=ftp_port, ftp_username=ftp_username,
+            ftp_password=ftp_password, timeout=timeout,
+            wait_connect=wait_connect)
+    # wvdial resets the modem.
+    serial_gsm.reset_state(ser)
+    return res
+
+
+def _ftp_request(port, ftp_file, ftp_host, apn, **kwargs):
+    # Every modem dials up on an interface of its own.
+    with ppp.sessions.session(port) as unit:
+        res = _ftp_request_on(port, ppp.interface_name(unit), unit,
+            ftp_file, ftp_host, apn, **kwargs)
+    return res
+
+
+def _ftp_request_on(port, interface, unit, ftp_file, ftp_host, apn,
+        ftp_filename='tmp', ftp_path='/tmp', ftp_port=21, ftp_username=None,
+        ftp_password=None, timeout=0, wait_connect=5):
+    proc = connect_wvdial(port, apn, unit)
+    res, err = check_if_connected(interface, wait_connect)
+
+    if not res:
+        proc.terminate()
+        return {
+            'interface': interface,
+            'error': 'Unable to establish a connection to the network: %s. Try increasing the `wait_connect` parameter.' % err,
+            'success': False,
+            'connected': False,
+        }
+
+    with use_interface(interface):
+        try:
+            ftp_utils.upload(
+                ftp_file,
+                ftp_host,
+                ftp_filename=ftp_filename,
+                ftp_port=ftp_port,
+                ftp_username=ftp_username,
+                ftp_password=ftp_password,
+                upload_path=ftp_path,
+                timeout=timeout
+            )
+        except Exception:
+            proc.terminate()
+            return {
+                'interface': interface,
+                'error': 'Request timed-out. Failed to upload. Try increasing the `timeout` parameter.',
+                'success': False,
+                'connected': True,
+            }
+
+    # Let's close the interface, finally.
+    proc.terminate()
+
+    return {
+        'interface': interface,
+        'error': None,
+        'success': True,
+        'connected': True,
+    }
+
+
 def flush_dns():
     print 'flusing dns...'
     cmd = ['/etc/init.d/dnsmasq', 'restart']
@@ -80,15 +273,6 @@ def flush_dns():
     print 'dns flushed'
 
 
-def set_default_gateway(ip):
-    print 'setting default gateway to network interface.'
-    cmd = ['/etc/init.d/dnsmasq', 'restart']
-    cmd = ['route', 'add', 'default', 'gw', ip]
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    print p.communicate()
-    print 'done'
-
-
 if __name__ == '__main__':
     #port = '/dev/ttyACM2'
     #p = connect_wvdial(port, 'http.globe.com.ph')
@@ -0,0 +1,139 @@
+import logging
+import os
+import threading
+
+from serial_utils import monotonic
+
+
+logger = logging.getLogger(__name__)
+
+# How many messages a modem may send per second, at most, and how
+# many it may send in a row before that rate kicks in.
+SMS_RATE = float(os.environ.get('GSM_SMS_RATE', 0.2))
+SMS_BURST = int(os.environ.get('GSM_SMS_BURST', 3))
+# The slowest we slow down to when sends keep failing.
+SMS_MIN_RATE = float(os.environ.get('GSM_SMS_MIN_RATE', 0.02))
+# What the rate is multiplied by on every failed send, and how much
+# of `SMS_RATE` is added back on every successful one.
+SMS_BACKOFF = 0.5
+SMS_RAMP_UP = 0.1
+
+
+class TokenBucket(object):
+    """Allows `rate` operations per second on average, in bursts of
+    up to `burst` operations."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self._updated = monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = monotonic()
+        self.tokens = min(self.burst,
+            self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self, tokens=1):
+        """Takes `tokens`, going into debt if there aren't enough.
+        Returns how many seconds to wait before they're actually
+        available."""
+        with self._lock:
+            self._refill()
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def delay(self, tokens=1):
+        """Returns how many seconds until `tokens` are available,
+        without taking them."""
+        with self._lock:
+            self._refill()
+            if self.tokens >= tokens:
+                return 0
+            return (tokens - self.tokens) / self.rate
+
+    def give(self, tokens=1):
+        """Gives back `tokens` that were taken but not used."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.burst, self.tokens + tokens)
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill()
+            self.rate = rate
+
+    def drain(self):
+        """Drops the tokens saved up so there's no burst."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0)
+
+
+class SendPacer(object):
+    """Paces the messages sent by a modem so the operator doesn't
+    throttle or bar the sim.
+
+    Every send takes a token from a `TokenBucket` with `reserve()`
+    before it's queued, and is only queued once the token is there,
+    so the modem's worker never sleeps waiting for one. Every failed
+    send halves the rate, down to `min_rate`, and every successful one
+    brings it back up a step, up to `rate`.
+    """
+
+    def __init__(self, rate=SMS_RATE, burst=SMS_BURST, min_rate=SMS_MIN_RATE):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.bucket = TokenBucket(rate, burst)
+        self.sent = 0
+        self.failed = 0
+
+    def reserve(self):
+        """Takes the token of a send. Returns how many seconds to wait
+        before sending."""
+        return self.bucket.take()
+
+    def release(self):
+        """Gives back the token of a send that didn't happen."""
+        self.bucket.give()
+
+    def run(self, fn, ser, *args, **kwargs):
+        """Runs the send `fn(ser, *args, **kwargs)`, whose token was
+        taken with `reserve()`, and adjusts the rate to how it went.
+        Returns its result."""
+        res = fn(ser, *args, **kwargs)
+        if res['success']:
+            self.sent += 1
+            # Every part of a long message counts as a message.
+            parts = len(res.get('parts', None) or [None])
+            if parts > 1:
+                self.bucket.take(parts - 1)
+            self._ramp_up()
+        else:
+            self.failed += 1
+            self._back_off()
+        return res
+
+    def _ramp_up(self):
+        if self.bucket.rate < self.max_rate:
+            self.bucket.set_rate(min(self.max_rate,
+                self.bucket.rate + self.max_rate * SMS_RAMP_UP))
+
+    def _back_off(self):
+        rate = max(self.min_rate, self.bucket.rate * SMS_BACKOFF)
+        logger.info('PACING::Send failed, slowing down to %.3f/s' % rate)
+        self.bucket.set_rate(rate)
+        self.bucket.drain()
+
+    def to_dict(self):
+        return {
+            'rate': self.bucket.rate,
+            'max_rate': self.max_rate,
+            'burst': self.bucket.burst,
+            'sent': self.sent,
+            'failed': self.failed,
+        }
@@ -0,0 +1,84 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+# How many dial-up sessions can run at the same time, one ppp
+# interface (ppp0, ppp1, ...) each.
+PPP_UNITS = int(os.environ.get('GSM_PPP_UNITS', 32))
+
+# Where the kernel lists the network interfaces that exist.
+NET_INTERFACES_PATH = '/sys/class/net'
+
+
+class NoFreeInterface(Exception):
+    """Raised when every ppp interface is taken."""
+
+
+def interface_name(unit):
+    return 'ppp%d' % unit
+
+
+def interface_exists(interface):
+    return os.path.exists(os.path.join(NET_INTERFACES_PATH, interface))
+
+
+class PPPManager(object):
+    """Gives the dial-up session of each modem a ppp interface of its
+    own, so sessions on several modems can run at the same time.
+
+    pppd is told which unit to use (`unit N` makes it `pppN`), so we
+    know which interface belongs to which port without racing other
+    sessions for it.
+    """
+
+    def __init__(self, units=PPP_UNITS):
+        self.units = units
+        self._lock = threading.Lock()
+        self._sessions = {}  # port -> session
+
+    def acquire(self, port):
+        """Reserves a free unit for the session on `port` and returns
+        it. Interfaces still up from an earlier session (eg. while
+        pppd is hanging up) are skipped. Raises `NoFreeInterface`."""
+        with self._lock:
+            taken = set(s['unit'] for s in self._sessions.values())
+            for unit in xrange(self.units):
+                if unit in taken or interface_exists(interface_name(unit)):
+                    continue
+                self._sessions[port] = {
+                    'unit': unit,
+                    'interface': interface_name(unit),
+                    'started': time.time(),
+                }
+                return unit
+        raise NoFreeInterface('All %s ppp interfaces are in use.' % self.units)
+
+    def release(self, port):
+        with self._lock:
+            self._sessions.pop(port, None)
+
+    @contextmanager
+    def session(self, port):
+        """Reserves a unit for `port` for as long as the block runs.
+        Yields the unit."""
+        unit = self.acquire(port)
+        logger.info('PPP::%s uses %s' % (port, interface_name(unit)))
+        try:
+            yield unit
+        finally:
+            self.release(port)
+
+    def sessions(self):
+        """Returns the session (its `interface` and when it `started`)
+        of every port that's dialed up."""
+        with self._lock:
+            return dict((port, dict(s)) for port, s in self._sessions.items())
+
+
+# The sessions of every modem in this process.
+sessions = PPPManager()
@@ -0,0 +1,84 @@
+import json
+import logging
+import os
+import re
+
+
+logger = logging.getLogger(__name__)
+
+# Country calling code of the numbers we route.
+COUNTRY_CODE = os.environ.get('GSM_COUNTRY_CODE', '63')
+
+# Number prefixes of each carrier, in national format. Carriers are
+# matched against the operator name the modems report (AT+COPS?)
+# regardless of case. Can be replaced with a JSON file of the same
+# shape in `GSM_CARRIER_PREFIXES`.
+CARRIER_PREFIXES = {
+    'globe': [
+        '0905', '0906', '0915', '0916', '0917', '0926', '0927', '0935',
+        '0936', '0945', '0955', '0956', '0965', '0966', '0967', '0975',
+        '0977', '0995', '0997',
+    ],
+    'smart': [
+        '0907', '0908', '0909', '0910', '0912', '0918', '0919', '0920',
+        '0921', '0928', '0929', '0930', '0938', '0939', '0946', '0947',
+        '0948', '0949', '0950', '0989', '0998', '0999',
+    ],
+    'sun': [
+        '0922', '0923', '0924', '0925', '0931', '0932', '0933', '0934',
+        '0942', '0943',
+    ],
+}
+
+
+def _load_prefixes():
+    path = os.environ.get('GSM_CARRIER_PREFIXES', None)
+    if not path:
+        return CARRIER_PREFIXES
+    with open(path) as f:
+        return json.load(f)
+
+
+def _prefix_table(carriers):
+    """Maps every prefix to its carrier, longest prefixes first.
+    Carrier names are lowercased."""
+    table = []
+    for carrier, prefixes in carriers.items():
+        for prefix in prefixes:
+            table.append((prefix, carrier.lower()))
+    return sorted(table, key=lambda t: len(t[0]), reverse=True)
+
+
+PREFIX_TABLE = _prefix_table(_load_prefixes())
+
+
+def national_number(number):
+    """Returns a number in national format (eg. '0917...'), whether
+    it's given with the country code or not."""
+    digits = re.sub(r'\D', '', number or '')
+    if digits.startswith(COUNTRY_CODE):
+        return '0' + digits[len(COUNTRY_CODE):]
+    if digits and not digits.startswith('0'):
+        return '0' + digits
+    return digits
+
+
+def carrier_of_number(number):
+    """Returns the carrier a number belongs to, or None."""
+    number = national_number(number)
+    for prefix, carrier in PREFIX_TABLE:
+        if number.startswith(prefix):
+            return carrier
+    return None
+
+
+def carrier_of_operator(operator):
+    """Returns the carrier of an operator name (eg. 'Globe Telecom'),
+    or the lowercased name if it's not a carrier we know of."""
+    if not operator:
+        return None
+    operator = operator.lower()
+    for carrier in sorted(set(c for _, c in PREFIX_TABLE)):
+        if carrier in operator:
+            return carrier
+    return operator
@@ -0,0 +1,138 @@
+import logging
+
+from serial_protocol import Protocol
+from serial_stream import TIMEOUT_RESPONSE
+from serial_utils import monotonic
+
+
+logger = logging.getLogger(__name__)
+
+CALL_RES_STATES = [
+    'OK',  # Call is successfully conncted.
+    'BUSY',  # Call is cancelled by the other end.
+    'NO CARRIER',  # Call is ended?
+    'NO DIALTONE',  # No dialtone...
+    '+CME ERROR:',  # Call timeout.
+]
+# Lines that tell us a call is over, or never started.
+CALL_ENDED_STATES = ['BUSY', 'NO CARRIER', 'NO DIALTONE', '+CME ERROR:']
+
+# How long we wait for the modem to hang up.
+HANGUP_TIMEOUT = 10
+# The `res` of a call that nobody picked up in time.
+CALL_NOT_ANSWERED = 'NO ANSWER'
+
+
+class Dial(Protocol):
+    """Dials a number and hangs up after `duration` seconds, unless
+    the other side hangs up first. The result is a dictionary with
+    whether the call got `connected` and its `duration`."""
+
+    def __init__(self, ser, number, duration=0, timeout=30):
+        super(Dial, self).__init__(ser)
+        self.number = number
+        self.started = None
+
+        ended = dict((s, self.not_connected) for s in CALL_ENDED_STATES)
+        self.add_state('dial', enter=self.dial,
+            on=dict(ended, OK='connected', **{'+CME ERROR:': 'redial'}),
+            timeout=timeout, on_timeout=self.not_answered)
+        # If we receive a 'CME ERROR: 100', it means that we
+        # got a busy. And for some weird reason, the data is not
+        # streamed into the serial comm. What we do here then
+        # is send a `\r` to refresh buffer.
+        self.add_state('redial', enter=self.refresh,
+            on=dict(ended, OK='connected'),
+            timeout=timeout, on_timeout=self.not_answered)
+        self.add_state('connected', enter=self.connected,
+            on=dict((s, 'hangup') for s in CALL_ENDED_STATES),
+            timeout=duration, on_timeout='hangup')
+        self.add_state('hangup', enter=self.hangup,
+            on=dict((s, self.finish) for s in CALL_RES_STATES),
+            timeout=HANGUP_TIMEOUT, on_timeout=self.finish)
+
+    def command(self):
+        self.goto('dial')
+
+    def dial(self):
+        self.transport.write('ATD%s;\r' % self.number)
+
+    def refresh(self):
+        self.transport.write('\r')
+
+    def not_connected(self, l=None):
+        res = '\n'.join(self.received) if l else TIMEOUT_RESPONSE
+        self.set_result({'connected': False, 'duration': 0, 'res': res})
+
+    def not_answered(self):
+        # Ringing until the timeout is up to the other side, not the
+        # modem.
+        self.set_result({'connected': False, 'duration': 0,
+            'res': CALL_NOT_ANSWERED})
+
+    def connected(self):
+        self.started = monotonic()
+
+    def hangup(self):
+        self.transport.write('AT+CHUP\r')
+
+    def finish(self, l=None):
+        self.set_result({
+            'connected': True,
+            'duration': int(monotonic() - self.started),
+            'res': '\n'.join(self.received) if l else TIMEOUT_RESPONSE,
+        })
+
+
+class AnswerCall(Protocol):
+    """Answers a ringing call and hangs up after `duration` seconds,
+    unless the other side hangs up first. The result is a dictionary
+    with whether the call got `connected` and its `duration`."""
+
+    def __init__(self, ser, duration=0, timeout=30):
+        super(AnswerCall, self).__init__(ser)
+        self.started = None
+        self.add_state('answer', enter=self.answer,
+            on={'OK': 'connected', 'ERROR': self.not_connected},
+            timeout=timeout, on_timeout='connected')
+        self.add_state('connected', enter=self.connected,
+            on={'NO CARRIER': self.finish},
+            timeout=duration, on_timeout='hangup')
+        self.add_state('hangup', enter=self.hangup,
+            on={'OK': self.finish, 'ERROR': self.finish},
+            timeout=timeout, on_timeout=self.finish)
+
+    def command(self):
+        self.goto('answer')
+
+    def answer(self):
+        self.transport.write('ATA\r')
+
+    def not_connected(self, l=None):
+        self.set_result({'connected': False, 'duration': 0})
+
+    def connected(self):
+        self.started = monotonic()
+
+    def hangup(self):
+        self.transport.write('AT+CHUP\r')
+
+    def finish(self, l=None):
+        self.set_result({
+            'connected': True,
+            'duration': int(monotonic() - self.started),
+        })
+
+
+class WaitAndAnswerCall(AnswerCall):
+    """Waits up to `timeout` seconds for a call, then answers it like
+    `AnswerCall`."""
+
+    def __init__(self, ser, duration=0, timeout=30):
+        super(WaitAndAnswerCall, self).__init__(ser, duration=duration,
+            timeout=timeout)
+        self.add_state('ring', on={'RING': 'answer'},
+            timeout=timeout, on_timeout=self.not_connected)
+
+    def command(self):
+        self.goto('ring')
@@ -2,22 +2,69 @@ import time
 import socket
 import fcntl
 import struct
+import logging
+import weakref
 
+import sms_pdu
+from serial_call import AnswerCall, Dial, WaitAndAnswerCall
+from serial_sms import SMS_SEND_TIMEOUT, ListMessages, SendSMS
+from serial_stream import TIMEOUT_RESPONSE, wait_for_tokens
 from serial_ussd import USSDSend
+from serial_utils import monotonic
 
 
+logger = logging.getLogger(__name__)
+
 true_socket = socket.socket
 
 
-MULTIPART_HEADER = '\x05\x00\x0c'
-CALL_RES_STATES = [
-    'OK',  # Call is successfully conncted.
-    'BUSY',  # Call is cancelled by the other end.
-    'NO CARRIER',  # Call is ended?
-    'NO DIALTONE',  # No dialtone...
-    'CME ERROR:',  # Call timeout.
-]
 GENERIC_SYSTEM_ERROR = 'Modem might be out of coverage. Check modem and try again.'
+# The error of a message the network refused (+CMS ERROR).
+SMS_REJECTED_ERROR = 'Message rejected by the network: %s'
+# Message statuses as listed in PDU mode.
+PDU_STATUSES = {
+    0: 'REC UNREAD',
+    1: 'REC READ',
+    2: 'STO UNSENT',
+    3: 'STO SENT',
+}
+# AT+CMGL status that lists all the messages in PDU mode.
+PDU_LIST_ALL = 4
+# AT+CMGD flags that delete all the read messages, or all the
+# messages no matter their status, in one go.
+CMGD_DELETE_READ = 1
+CMGD_DELETE_ALL = 4
+# AT+CMGL status that lists the read messages in PDU mode.
+PDU_LIST_READ = 1
+# The message format, new message indications and USSD session state
+# we know each modem has, by port. See `configure()`.
+MODEM_STATES = weakref.WeakKeyDictionary()
+# Settings we keep track of.
+STATE_CMGF = 'CMGF'
+STATE_CNMI = 'CNMI'
+STATE_USSD = 'USSD'
+# PDU mode, and the indications `enable_notifications()` turns on.
+CMGF_PDU = '0'
+CNMI_NOTIFY = '2,1,0,1,0'
+# The last USSD session was ended by the network.
+USSD_CLOSED = 'closed'
+# Network registration statuses (AT+CREG).
+REGISTRATION_STATUSES = {
+    0: 'not registered',
+    1: 'registered',
+    2: 'searching',
+    3: 'denied',
+    4: 'unknown',
+    5: 'roaming',
+}
+# How long we sleep between inbox reads when the port can't notify
+# us of new messages.
+SMS_POLL_INTERVAL = 1
+
+
+class ModemTimeout(Exception):
+    """Raised when the modem doesn't answer a command whose result
+    can't carry an error, eg. reading the inbox."""
 
 
 def make_bound_socket(ip):
@@ -67,144 +114,206 @@ def _parse_cpbr(s):
     return _numbers
 
 
-def _parse_cmgl_header(s):
-    """Parses a cmgl row data into a dictionary."""
-    try:
-        index, status, origin, _, date, time = s.strip('+CMGL: ').split(',')
-    except ValueError:
-        return {
-            'index': None,
-            'status': None,
-            'origin': None,
-            'date': None,
-            'time': None,
-            'message': s,
-        }
-    y, m, d = date.split('/')
-    date = '/'.join([m,d,y])
-    return {
-        'index': int(index),
-        'status': status.replace('"', ''),
-        'origin': origin.replace('"', ''),
-        'date': date.replace('"', ''),
-        'time': time.replace('"', '').split('+')[0],
-        'message': None,
-    }
-
-
-def _merge_multipart_messages(messages):
-    """Merges any multipart messages. Expects a list of
-    message objects (parsed from _parse_cmgl)."""
-    all_messages = []
-    multiparts = {}
-    for m in messages:
-        # If the message is a multipart message.
-        if m['message'].startswith(MULTIPART_HEADER):
-            mes = m['message'].strip(MULTIPART_HEADER)
-            # We retrieve the message id and the actual
-            # message.
-            id, mes = mes.split('\x00', 1)
-            # Cleanup message.
-            mes = mes.replace('\x00', '')
-            id = id[0][:2]
-            m['message'] = mes
-            if not multiparts.get(id, None):
-                multiparts[id] = m
-                continue
-            multiparts[id]['message'] += mes
-        else:
-            all_messages.append(m)
-
-    all_messages = all_messages + multiparts.values()
-    return sorted(all_messages, key=lambda m: m['index'])
+def _parse_pdu_header(s):
+    """Parses the header of a +CMGL (`+CMGL: <index>,<stat>,,<length>`)
+    or +CMGR (`+CMGR: <stat>,,<length>`) row into (index, stat)."""
+    fields = s.split(':', 1)[1].split(',')
+    if s.startswith('+CMGL:'):
+        return int(fields[0]), int(fields[1])
+    return None, int(fields[0])
 
 
-def _parse_cmgl(s):
-    """Parses a cmgl response."""
-    res = s.strip().rstrip()
-    parts = []
+def _parse_pdu_messages(s, index=None):
+    """Parses the rows of a PDU mode +CMGL/+CMGR response in a
+    single pass. Returns the messages (not merged), each with the
+    `concat` info of `sms_pdu.decode()`."""
     messages = []
-    for l in res.split('\n')[1:]:
-        l = l.strip().rstrip()
-        # The response has been fully processed. Let's
-        # return the last message set.
-        if l[:2] == 'OK':
-            if not parts and not messages:
-                break
-            m = '\n'.join(parts)
-            message['message'] = m
-            parts = []
-            messages.append(message)
-            break
-
-        # Check if the current line is a header.
-        if l[:6] == '+CMGL:':
-            if parts:
-                m = '\n'.join(parts)
-                message['message'] = m
-                parts = []
-                messages.append(message)
-            message = _parse_cmgl_header(l)
+    header = None
+    for l in s.split('\n'):
+        l = l.strip()
+        if l.startswith('+CMGL:') or l.startswith('+CMGR:'):
+            header = _parse_pdu_header(l)
             continue
+        # The row after a header is the PDU itself.
+        if header is None or not l:
+            continue
+        i, stat = header
+        header = None
+        try:
+            m = sms_pdu.decode(l)
+        except sms_pdu.PDUError as e:
+            logger.warning('Unable to decode PDU %s: %s' % (l, e))
+            continue
+        # Status reports aren't messages.
+        if m['type'] == sms_pdu.TYPE_STATUS_REPORT:
+            continue
+        messages.append({
+            'index': i if i is not None else index,
+            'status': PDU_STATUSES.get(stat, None),
+            'origin': m['origin'],
+            'date': m['date'],
+            'time': m['time'],
+            'message': m['message'],
+            'concat': m['concat'],
+        })
+    return messages
 
-        # This must be a fragment of a message.
-        if l:
-            parts.append(l)
 
-    return _merge_multipart_messages(messages)
+def _parse_cmgl(s):
+    """Parses a PDU mode cmgl response. Parts of concatenated
+    messages are merged (see `sms_pdu.merge_parts()`)."""
+    return sms_pdu.merge_parts(_parse_pdu_messages(s))
 
 
 def wait_for_strs(ser, strs, timeout=0):
     """Waits for any of the provided strings in the serial
-    stream.
+    stream. Returns everything read until the match.
 
     If `timeout` is set to 0, this function blocks until
     a provided string matches.
 
-    If `timeout` is set to > 1, this function blocks until
-    a provided string matches or until the provided timeout.
+    If `timeout` is set to > 0, this function blocks until
+    a provided string matches or until the provided timeout
+    (in seconds, may be fractional).
     """
-    started = int(time.time())
-    _buffer = ''
-    while True:
-        res = ser.readall()
-        _buffer += res
-        for s in strs:
-            if s in res:
-                return _buffer
-        if timeout:
-            elapsed = int(time.time()) - started
-            if elapsed >= timeout:
-                return 'CME ERROR: TIMEOUT'
-
-
-def send_sms(ser, recipient, message):
-    """Sends an sms to a recipient (msisdn)."""
-    ser.write('AT+CMGF=1\r')
-    res = wait_for_strs(ser, ['OK'])
-    ser.write('AT+CMGS="%s"\r' % recipient)
-    time.sleep(0.5)
-    ser.write('%s\r' % message)
-    ser.write(chr(26))
-    res = wait_for_strs(ser, ['OK', 'ERROR'])
-    if 'ERROR' in res:
-        return {'success': False, 'res': res, 'error': GENERIC_SYSTEM_ERROR}
-    return {'success': True, 'res': res, 'error': None}
+    matcher = wait_for_tokens(ser, strs, timeout=timeout)
+    if matcher is None:
+        return TIMEOUT_RESPONSE
+    return matcher.text
 
 
-def delete_inbox_message(ser, index):
-    """Deletes an inbox message given an index."""
-    ser.write('AT+CMGD=%s\r' % index)
-    res = wait_for_strs(ser, ['OK', 'ERROR'])
-    if 'ERROR' in res:
+def _parse_creg(s):
+    """Returns the registration status of a +CREG response (`+CREG:
+    <n>,<stat>[,...]`) or None."""
+    for l in s.split('\n'):
+        l = l.strip()
+        if l.startswith('+CREG:'):
+            fields = l[6:].split(',')
+            return int(fields[1] if len(fields) > 1 else fields[0])
+    return None
+
+
+def _parse_cops(s):
+    """Returns the operator name of a +COPS response (`+COPS:
+    <mode>,<format>,"<operator>"[,<act>]`) or None."""
+    for l in s.split('\n'):
+        l = l.strip()
+        if l.startswith('+COPS:'):
+            fields = l[6:].split(',')
+            if len(fields) > 2:
+                return fields[2].strip().strip('"')
+    return None
+
+
+def _parse_cmgl_indexes(s):
+    """Returns the index of every row of a +CMGL response."""
+    indexes = []
+    for l in s.split('\n'):
+        l = l.strip()
+        if l.startswith('+CMGL:'):
+            indexes.append(int(l[6:].split(',')[0]))
+    return indexes
+
+
+def _parse_cpms(s):
+    """Parses a +CPMS response (`+CPMS: "SM",3,30,"SM",3,30,...`) into
+    the storage, messages used and total capacity of each memory."""
+    for l in s.split('\n'):
+        l = l.strip()
+        if not l.startswith('+CPMS:'):
+            continue
+        fields = l[6:].replace('"', '').split(',')
+        return [{
+            'storage': fields[i].strip(),
+            'used': int(fields[i + 1]),
+            'total': int(fields[i + 2]),
+        } for i in xrange(0, len(fields) - 2, 3)]
+    return []
+
+
+def modem_state(ser):
+    """Returns the settings we know the modem on `ser` has."""
+    return MODEM_STATES.setdefault(ser, {})
+
+
+def forget_state(ser):
+    """Forgets the settings of the modem on `ser`, so they're set
+    again the next time they're needed. Call this whenever the modem
+    might have been reset or has misbehaved."""
+    MODEM_STATES.pop(ser, None)
+
+
+def configure(ser, name, value, timeout=5):
+    """Sets `AT+<name>=<value>` unless we know the modem already has
+    it set. Returns whether the setting took."""
+    state = modem_state(ser)
+    if state.get(name) == value:
+        return True
+    ser.write('AT+%s=%s\r' % (name, value))
+    res = wait_for_strs(ser, ['OK', 'ERROR'], timeout=timeout)
+    if 'OK' not in res:
+        forget_state(ser)
         return False
+    state[name] = value
     return True
 
 
-def delete_inbox_messages(ser):
-    """Deletes all inbox messages."""
+def reset_state(ser):
+    """Forgets the settings of a modem that has been reset (eg. by
+    ATZ or wvdial) and turns new message indications back on."""
+    forget_state(ser)
+    enable_notifications(ser)
+
+
+def send_sms(ser, recipient, message, timeout=SMS_SEND_TIMEOUT):
+    """Sends an sms to a recipient (msisdn).
+
+    Long messages are sent as a concatenated message. The link to
+    the network is kept open between the parts (AT+CMMS). Each part
+    is written as soon as the modem prompts for it and its message
+    reference is returned in `parts`. See `serial_sms.SendSMS`.
+    """
+    pdus = sms_pdu.encode_submit(recipient, message)
+    configure(ser, STATE_CMGF, CMGF_PDU)
+    sms = SendSMS(ser, pdus, timeout=timeout)
+    err, _ = sms.run()
+    parts = [{'reference': r} for r in sms.references]
+    if err:
+        forget_state(ser)
+        # Only a modem that didn't answer gets the generic error.
+        error = GENERIC_SYSTEM_ERROR
+        if sms.res != TIMEOUT_RESPONSE:
+            error = SMS_REJECTED_ERROR % sms.res
+        return {'success': False, 'res': sms.res, 'error': error,
+            'parts': parts}
+    return {'success': True, 'res': sms.res, 'error': None, 'parts': parts}
+
+
+def delete_inbox_message(ser, index, timeout=5):
+    """Deletes an inbox message given an index. Returns whether the
+    modem deleted it."""
+    ser.write('AT+CMGD=%s\r' % index)
+    res = wait_for_strs(ser, ['OK', 'ERROR'], timeout=timeout)
+    return 'OK' in res
+
+
+def delete_inbox_messages(ser, flag=CMGD_DELETE_ALL):
+    """Deletes all inbox messages, or only the read ones if `flag` is
+    `CMGD_DELETE_READ`.
+
+    Uses a single AT+CMGD with a delete flag. Modems that don't
+    support delete flags get each message in use deleted instead.
+    """
+    ser.write('AT+CMGD=1,%s\r' % flag)
+    res = wait_for_strs(ser, ['OK', 'ERROR'], timeout=SMS_SEND_TIMEOUT)
+    if 'OK' in res:
+        return {'success': True}
+
     try:
-        for i in xrange(26):
+        configure(ser, STATE_CMGF, CMGF_PDU)
+        stat = PDU_LIST_READ if flag == CMGD_DELETE_READ else PDU_LIST_ALL
+        err, res = ListMessages(ser, stat).run()
+        for i in _parse_cmgl_indexes(res or ''):
             delete_inbox_message(ser, i)
     except Exception:
         return {'success': False}
@@ -212,27 +321,98 @@ def delete_inbox_messages(ser):
     return {'success': True}
 
 
+def storage_status(ser, timeout=5):
+    """Returns how full the message storage of the sim is, or None
+    if the modem can't tell us.
+
+    The storage is the one new messages are received in. Once it's
+    `full`, new messages are dropped. If the modem doesn't answer,
+    only the `error` is set.
+    """
+    ser.write('AT+CPMS?\r')
+    res = wait_for_strs(ser, ['OK', 'ERROR'], timeout=timeout)
+    if res == TIMEOUT_RESPONSE:
+        return {'storage': None, 'used': None, 'total': None, 'full': None,
+            'error': res}
+    memories = _parse_cpms(res)
+    if 'ERROR' in res or not memories:
+        return None
+    # The third memory is where received messages go.
+    status = dict(memories[-1])
+    status['full'] = status['used'] >= status['total']
+    status['error'] = None
+    return status
+
+
 def inbox_messages(ser):
-    """Returns all the inbox messages."""
-    ser.write('AT+CMGF=1\r')
-    res = wait_for_strs(ser, ['OK'])
-    ser.write('AT+CMGL=ALL\r')
-    res = wait_for_strs(ser, ['OK'])
+    """Returns all the inbox messages. Raises `ModemTimeout` if the
+    modem doesn't answer."""
+    configure(ser, STATE_CMGF, CMGF_PDU)
+    err, res = ListMessages(ser, PDU_LIST_ALL).run()
+    if err:
+        forget_state(ser)
+        if err == TIMEOUT_RESPONSE:
+            raise ModemTimeout(err)
+        return []
     return _parse_cmgl(res)
 
 
+def read_message(ser, index, timeout=5):
+    """Returns the inbox message at `index` or None. Raises
+    `ModemTimeout` if the modem doesn't answer.
+
+    If the message is a part of a concatenated message, its `concat`
+    info is kept so the parts can be merged with
+    `sms_pdu.merge_parts()`.
+    """
+    configure(ser, STATE_CMGF, CMGF_PDU)
+    ser.write('AT+CMGR=%s\r' % index)
+    res = wait_for_strs(ser, ['OK', 'ERROR'], timeout=timeout)
+    if res == TIMEOUT_RESPONSE:
+        raise ModemTimeout(res)
+    if 'ERROR' in res:
+        return None
+    messages = _parse_pdu_messages(res, index=index)
+    if not messages:
+        return None
+    return messages[0]
+
+
+def find_sms(ser, origin):
+    """Returns the first inbox message from `origin` or None."""
+    for m in inbox_messages(ser):
+        if origin.lower() in m['origin'].lower():
+            return m
+    return None
+
+
 def wait_for_sms(ser, origin, timeout=0):
-    """Waits for a message from a specific origin."""
-    started = int(time.time())
-    while True:
-        messages = inbox_messages(ser)
-        for m in messages:
-            if origin.lower() in m['origin'].lower():
+    """Waits for a message from a specific origin.
+
+    If the port publishes unsolicited result codes (see
+    `serial_urc.URCSerial`), the inbox is only read again once a
+    new message indication (+CMTI) arrives.
+    """
+    listen = getattr(ser, 'listen', None)
+    sub = listen(['CMTI']) if listen else None
+    started = monotonic()
+    try:
+        while True:
+            m = find_sms(ser, origin)
+            if m:
                 return {'message': m, 'error': None}
-        if timeout:
-            elapsed = int(time.time()) - started
-            if elapsed > timeout:
-                return {'message': None, 'error': 'Wait for SMS timed-out.'}
+            remaining = 0
+            if timeout:
+                remaining = timeout - (monotonic() - started)
+                if remaining <= 0:
+                    return {'message': None, 'error': 'Wait for SMS timed-out.'}
+            if sub:
+                sub.get(remaining)
+            else:
+                time.sleep(SMS_POLL_INTERVAL)
+    finally:
+        if sub:
+            sub.close()
 
 
 def sim_msisdn(ser):
@@ -253,6 +433,42 @@ def sim_msisdn(ser):
             return num['number']
 
 
+def _parse_identity(s, prefixes):
+    """Parses the id returned by AT+CCID, AT^SCID or AT+CIMI."""
+    for l in s.split('\n'):
+        l = l.strip()
+        for p in prefixes:
+            if l.startswith(p):
+                l = l[len(p):].strip()
+        l = l.replace('"', '')
+        if len(l) >= 10 and l.isalnum() and l[:2].isdigit():
+            return l
+    return None
+
+
+# Identity queries in order of preference. The ICCID is tied to the
+# sim card itself so we prefer it over the IMSI.
+SIM_IDENTITY_COMMANDS = [
+    ('iccid', 'AT+CCID\r', ['+CCID:']),
+    ('iccid', 'AT^SCID\r', ['^SCID:']),  # Cinterion modems.
+    ('imsi', 'AT+CIMI\r', []),
+]
+
+
+def sim_identity(ser, timeout=2):
+    """Returns a string that identifies the sim in the modem (eg.
+    'iccid:8963...') or None if the modem can't tell us."""
+    for kind, command, prefixes in SIM_IDENTITY_COMMANDS:
+        ser.write(command)
+        res = wait_for_strs(ser, ['OK', 'ERROR'], timeout=timeout)
+        if 'ERROR' in res:
+            continue
+        id = _parse_identity(res, prefixes)
+        if id:
+            return '%s:%s' % (kind, id)
+    return None
+
+
 def call(ser, number, duration=0, timeout=30):
     """Dials a number.
 
@@ -262,27 +478,10 @@ def call(ser, number, duration=0, timeout=30):
 
     Once the call has been connected, if a `duration` is
     set, the call proceeds until the specified duration.
+    See `serial_call.Dial`.
     """
-    ser.write('ATD%s;\r' % number)
-    res = wait_for_strs(ser, CALL_RES_STATES, timeout=timeout)
-    # If we receive a 'CME ERROR: 100', it means that we
-    # got a busy. And for some weird reason, the data is not
-    # streamed into the serial comm. What we do here then
-    # is send a `\r` to refresh buffer.
-    if 'CME ERROR:' in res:
-        ser.write('\r')
-        res = wait_for_strs(ser, CALL_RES_STATES, timeout=timeout)
-    # If the call has not been successfully connected, the
-    # function exits.
-    if 'OK' not in res:
-        return {'connected': False, 'duration': 0, 'res': res}
-    started = int(time.time())
-    # Let's wait until the call is bound to end or the call
-    # has been ended from the other side.
-    res = wait_for_strs(ser, CALL_RES_STATES, timeout=duration)
-    ser.write('AT+CHUP\r')
-    res = wait_for_strs(ser, CALL_RES_STATES, timeout=duration)
-    return {'connected': True, 'duration': int(time.time()) - started, 'res': res}
+    err, res = Dial(ser, number, duration=duration, timeout=timeout).run()
+    return res or {'connected': False, 'duration': 0, 'res': err}
 
 
 def wait_and_answer_call(ser, duration=0, timeout=30):
@@ -294,19 +493,14 @@ def wait_and_answer_call(ser, duration=0, timeout=30):
 
     If a set `duration` the call is ended prematurely
     """
-    res = wait_for_strs(ser, ['RING'], timeout=timeout)
-    if 'RING' not in res:
-        return {'connected': False, 'duration': 0}
-    ser.write('ATA\r')
-    res = wait_for_strs(ser, ['OK'], timeout=timeout)
-    started = int(time.time())
-    res = wait_for_strs(ser, ['NO CARRIER'], timeout=duration)
-    # If the call was not ended from the other side and
-    # we've reached the expected call duration.
-    if not 'NO CARRIER' in res:
-        ser.write('AT+CHUP\r')
-        wait_for_strs(ser, ['OK'], timeout=timeout)
-    return {'connected': True, 'duration': int(time.time()) - started}
+    err, res = WaitAndAnswerCall(ser, duration=duration, timeout=timeout).run()
+    return res or {'connected': False, 'duration': 0}
+
+
+def answer_call(ser, duration=0, timeout=30):
+    """Answers a ringing call. See `wait_and_answer_call()`."""
+    err, res = AnswerCall(ser, duration=duration, timeout=timeout).run()
+    return res or {'connected': False, 'duration': 0}
 
 
 def ussd_send(ser, command, timeout=0):
@@ -318,11 +512,23 @@ def ussd_send(ser, command, timeout=0):
     does not follow the provided timeout.
     """
     print('USSD::Command: %s' % command)
-    ser.write('AT+CUSD=2\r')
-    print('USSD::Clear: %s' % ser.readall())
-    err, res = USSDSend(ser, command).run(timeout)
+    state = modem_state(ser)
+    # Only cancel the last session and reset the modem when we don't
+    # know that the network has ended the last session.
+    reset = state.get(STATE_USSD) != USSD_CLOSED
+    if reset:
+        ser.write('AT+CUSD=2\r')
+        print('USSD::Clear: %s' % ser.readall())
+    ussd = USSDSend(ser, command, reset=reset)
+    err, res = ussd.run(timeout)
     print('USSD::Error: %s' % err)
     print('USSD::Result: %s' % res)
+    if reset:
+        reset_state(ser)
+    if err is None and ussd.closed:
+        modem_state(ser)[STATE_USSD] = USSD_CLOSED
+    else:
+        forget_state(ser)
     return {
         'success': True,
         'message': res,
@@ -356,11 +562,38 @@ def check_modem(ser, timeout=0.5):
     return True
 
 
+def soft_reset(ser, timeout=5):
+    """Resets the modem to its default settings (ATZ). Returns
+    whether it took."""
+    ser.write('ATZ\r')
+    res = wait_for_strs(ser, ['OK', 'ERROR'], timeout=timeout)
+    forget_state(ser)
+    return 'OK' in res
+
+
+def restart_radio(ser, timeout=15):
+    """Turns the radio of the modem off and back on (AT+CFUN), which
+    also makes it register to the network again. Returns whether it
+    took."""
+    ser.write('AT+CFUN=0\r')
+    wait_for_strs(ser, ['OK', 'ERROR'], timeout=timeout)
+    ser.write('AT+CFUN=1\r')
+    res = wait_for_strs(ser, ['OK', 'ERROR'], timeout=timeout)
+    forget_state(ser)
+    return 'OK' in res
+
+
+def enable_notifications(ser, timeout=5):
+    """Turns on new message indications (+CMTI) and status
+    reports (+CDS) so they're pushed to us as they arrive."""
+    return configure(ser, STATE_CNMI, CNMI_NOTIFY, timeout=timeout)
+
+
 def check_signal(ser, timeout=0):
     """Checks the modem current signal quality."""
     ser.write('AT+CSQ\r')
     res = wait_for_strs(ser, ['ERROR', 'OK'], timeout=timeout)
-    if 'ERROR' in res:
+    if 'ERROR' in res or '+CSQ:' not in res:
         return {'error': res, 'rssi': None, 'ber': None}
     # Parse the signal quality
     m = res.split('+CSQ:')[1].replace('OK', '').replace('\n', '').strip()
@@ -368,6 +601,21 @@ def check_signal(ser, timeout=0):
     return {'error': None, 'rssi': rssi, 'ber': ber}
 
 
+def network_status(ser, timeout=2):
+    """Returns whether the modem is registered to the network and
+    the name of the operator it's on."""
+    ser.write('AT+CREG?\r')
+    stat = _parse_creg(wait_for_strs(ser, ['OK', 'ERROR'], timeout=timeout))
+    ser.write('AT+COPS?\r')
+    operator = _parse_cops(wait_for_strs(ser, ['OK', 'ERROR'],
+        timeout=timeout))
+    return {
+        'registration': REGISTRATION_STATUSES.get(stat, None),
+        'registered': stat in (1, 5),
+        'operator': operator,
+    }
+
+
 if __name__ == '__main__':
     import sys
     import logging
@@ -1,33 +1,107 @@
 import logging
-import time
 
-from serial_utils import clean_lines
+from serial_stream import TIMEOUT_RESPONSE, read_available
+from serial_utils import monotonic
 
 
 logger = logging.getLogger(__name__)
 
+# Lines the modem doesn't terminate, like the prompt for a message.
+PROMPTS = ('>',)
+
+
+class PrefixTrie(object):
+    """Maps string prefixes to values. Finds the values of every
+    prefix of a line in a single pass over the line, however many
+    prefixes there are."""
+
+    def __init__(self):
+        self._root = {}
+
+    def add(self, prefix, value):
+        node = self._root
+        for c in prefix:
+            node = node.setdefault(c, {})
+        node.setdefault(None, []).append(value)
+
+    def get(self, prefix):
+        """Returns the values added for exactly `prefix`."""
+        node = self._root
+        for c in prefix:
+            node = node.get(c, None)
+            if node is None:
+                return []
+        return node.get(None, [])
+
+    def match(self, s):
+        """Returns the values of every prefix of `s`, shortest prefix
+        first."""
+        node = self._root
+        values = list(node.get(None, []))
+        for c in s:
+            node = node.get(c, None)
+            if node is None:
+                break
+            values.extend(node.get(None, []))
+        return values
+
 
 class Event(object):
 
     def __init__(self):
-        self._events = {}
+        self._events = PrefixTrie()
 
     def emit(self, event, data):
-        cbs = self._events.get(event, [])
-        for c in cbs:
+        for c in self._events.get(event):
             c(data)
 
     def on(self, event, cb):
-        cbs = self._events.get(event, [])
-        cbs.append(cb)
-        self._events[event] = cbs
+        self._events.add(event, cb)
+
+
+class State(object):
+    """A step of a `Protocol`.
+
+    `enter()` is called when the protocol moves to the state, usually
+    to write a command. `on` maps line prefixes to what happens when a
+    line starting with it arrives: either the name of the next state
+    or a handler called with the line, which returns the name of the
+    next state or None to stay. When more than one prefix matches, the
+    longest one wins.
+
+    If no line moves the protocol on within `timeout` seconds (0 waits
+    forever), `on_timeout()` is called the same way. Without it, the
+    protocol fails with `TIMEOUT_RESPONSE`.
+    """
+
+    def __init__(self, name, enter=None, on=None, timeout=0, on_timeout=None):
+        self.name = name
+        self.enter = enter
+        self.timeout = timeout
+        self.on_timeout = on_timeout
+        self.transitions = PrefixTrie()
+        for prefix, handler in (on or {}).items():
+            self.transitions.add(prefix, handler)
 
 
 class Protocol(Event):
+    """Drives an exchange with the modem.
+
+    Lines read from the port are dispatched to the transitions of the
+    current `State` (see `add_state()` and `goto()`) and to the
+    handlers registered with `on()`. The protocol runs until a handler
+    sets a result or an error.
+    """
 
     def __init__(self, ser):
         super(Protocol, self).__init__()
         self.transport = ser
+        self.state = None
+        # The lines received since we entered the current state.
+        self.received = []
+        self._states = {}
+        self._state_deadline = None
+        self._partial = ''
         self._result = None
         self._error = None
         self._has_result = False
@@ -48,6 +122,31 @@ class Protocol(Event):
     def error(self):
         return self._error
 
+    def add_state(self, *args, **kwargs):
+        """Adds a `State` built from the given arguments."""
+        state = State(*args, **kwargs)
+        self._states[state.name] = state
+        return state
+
+    def goto(self, name):
+        """Moves to the state `name` and enters it."""
+        logger.debug('PROTOCOL::State: %s' % name)
+        self.state = self._states[name]
+        self.received = []
+        self._state_deadline = None
+        if self.state.timeout:
+            self._state_deadline = monotonic() + self.state.timeout
+        if self.state.enter:
+            self._transition(self.state.enter)
+
+    def _transition(self, handler, *args):
+        if self._has_result:
+            return
+        if callable(handler):
+            handler = handler(*args)
+        if handler:
+            self.goto(handler)
+
     def command(self):
         pass
 
@@ -60,53 +159,71 @@ class Protocol(Event):
     def emit(self, l):
         """Overrides Event.emit() so we only need to
         provide the data we've been given."""
-        print('PROTOCOL::Emit: %s' % l)
-        for be in self._events.keys():
-            if l.startswith(be):
-                super(Protocol, self).emit(be, l)
-
-    def fn(self):
-        """Primary function to execute on each loop."""
-        for l in clean_lines(self.transport.readall().split('\r\n')):
+        logger.debug('PROTOCOL::Emit: %s' % l)
+        self.received.append(l)
+        if self.state is not None:
+            handlers = self.state.transitions.match(l)
+            if handlers:
+                self._transition(handlers[-1], l)
+        for c in self._events.match(l):
+            c(l)
+
+    def feed(self, data):
+        """Dispatches the complete lines in `data`. The rest is kept
+        until the line is complete, except for prompts."""
+        lines = (self._partial + data).split('\n')
+        self._partial = lines.pop()
+        for l in lines:
+            l = l.strip()
+            if l:
+                self.emit(l)
+        if self._partial.strip().startswith(PROMPTS):
+            l, self._partial = self._partial.strip(), ''
             self.emit(l)
 
     def run(self, timeout=0):
         """Executes the self.command() then runs the event
-        loop. Terminates once self.result() no longer
-        returns a False'y value.
+        loop. Terminates once a result or an error is set.
 
         If a timeout is set, this function runs until the
         specified timeout. Returns the default result
-        value (None).
+        value (None) and `TIMEOUT_RESPONSE` as the error.
 
         Executes in this order:
         command
             -> loop(
                 -> before
-                -> [result -> timeout]
-                -> fn
+                -> [result -> timeout -> state timeout]
+                -> wait for data -> emit
                 -> after
             )
         """
-        _started = int(time.time())
+        deadline = monotonic() + timeout if timeout else None
         self.command()
         while True:
-            logger.debug('Looping...')
-            logger.debug('Before...')
             self.before()
 
             if self._has_result:
                 return (self.error, self.result)
 
-            duration = int(time.time()) - _started
-            if timeout != 0:
-                if duration > timeout:
-                    logger.debug('Request Timed-out')
-                    return ('Request Timed-out', None)
+            now = monotonic()
+            if deadline is not None and now >= deadline:
+                logger.debug('Request Timed-out')
+                return (TIMEOUT_RESPONSE, None)
+
+            if self._state_deadline is not None and \
+                    now >= self._state_deadline:
+                self._state_deadline = None
+                if self.state.on_timeout:
+                    self._transition(self.state.on_timeout)
+                else:
+                    self.set_error(TIMEOUT_RESPONSE)
+                continue
+
+            # Sleep until data arrives or the nearest deadline.
+            wait = [d - now for d in (deadline, self._state_deadline)
+                if d is not None]
+            self.feed(read_available(self.transport,
+                min(wait) if wait else None))
 
-            self.fn()
-
-            logger.debug('After...')
             self.after()
-
-
@@ -0,0 +1,85 @@
+import errno
+import logging
+import os
+import select
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+_EPOLL = hasattr(select, 'epoll')
+READ_EVENTS = (select.EPOLLIN | select.EPOLLPRI | select.EPOLLERR |
+    select.EPOLLHUP) if _EPOLL else (select.POLLIN | select.POLLPRI |
+    select.POLLERR | select.POLLHUP)
+
+
+class Reactor(threading.Thread):
+    """Waits on every registered port from a single thread, with
+    epoll (or poll where epoll is missing), and calls the port's
+    `on_readable()` as soon as it has data.
+
+    A port is anything with `fileno()` and `on_readable()`, usually a
+    `serial_urc.URCSerial`. The thread sleeps until one of the ports
+    has data, so idle modems don't cost anything however many there
+    are.
+    """
+
+    def __init__(self):
+        super(Reactor, self).__init__(name='serial-reactor')
+        self.daemon = True
+        self._ports = {}  # fd -> port
+        self._lock = threading.Lock()
+        self._poller = select.epoll() if _EPOLL else select.poll()
+        # Wakes the loop up when ports are added or removed, since
+        # poll() only sees the changes on its next call.
+        self._wakeup, self._waker = os.pipe()
+        self._poller.register(self._wakeup, READ_EVENTS)
+
+    def register(self, port):
+        fd = port.fileno()
+        with self._lock:
+            self._ports[fd] = port
+            self._poller.register(fd, READ_EVENTS)
+        self._wake()
+
+    def unregister(self, port):
+        with self._lock:
+            for fd, p in self._ports.items():
+                if p is port:
+                    del self._ports[fd]
+                    try:
+                        self._poller.unregister(fd)
+                    except (IOError, KeyError, ValueError):
+                        pass
+        self._wake()
+
+    def _wake(self):
+        os.write(self._waker, 'x')
+
+    def _poll(self):
+        try:
+            if _EPOLL:
+                return self._poller.poll(-1)
+            return self._poller.poll()
+        except (IOError, OSError, select.error) as e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+
+    def run(self):
+        while True:
+            for fd, events in self._poll():
+                if fd == self._wakeup:
+                    os.read(self._wakeup, 4096)
+                    continue
+                port = self._ports.get(fd, None)
+                if port is None:
+                    continue
+                try:
+                    port.on_readable()
+                except Exception:
+                    # Most likely unplugged. Stop watching it so we
+                    # don't spin on its errors.
+                    logger.exception('REACTOR::Read failed: %s' %
+                        getattr(port, 'port', fd))
+                    self.unregister(port)
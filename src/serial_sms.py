@@ -0,0 +1,122 @@
+import logging
+
+from serial_protocol import Protocol
+from serial_stream import TIMEOUT_RESPONSE
+
+
+logger = logging.getLogger(__name__)
+
+# How long we wait for the network to accept a message.
+SMS_SEND_TIMEOUT = 60
+# How long we wait for the modem to answer other commands.
+COMMAND_TIMEOUT = 10
+
+# Lines that end a command with an error.
+ERRORS = ['ERROR', '+CMS ERROR', '+CME ERROR']
+
+TERMINATE = chr(26)
+
+
+def _parse_cmgs(l):
+    """Returns the message reference of a +CMGS line."""
+    return int(l[6:].split(',')[0])
+
+
+class SendSMS(Protocol):
+    """Sends the PDUs of a message (see `sms_pdu.encode_submit()`).
+
+    Each PDU is written as soon as the modem prompts for it. The link
+    to the network is kept open between the parts of a long message
+    (AT+CMMS). The result is the message reference of every part.
+    """
+
+    def __init__(self, ser, pdus, timeout=SMS_SEND_TIMEOUT):
+        super(SendSMS, self).__init__(ser)
+        self.pdus = list(pdus)
+        self.multipart = len(self.pdus) > 1
+        self.references = []
+        # The response to the last command.
+        self.res = ''
+        self._failure = None
+
+        errors = dict((e, self.fail) for e in ERRORS)
+        # Failing to hold the link isn't fatal.
+        self.add_state('hold', enter=self.hold,
+            on=dict((e, 'prompt') for e in ERRORS + ['OK']),
+            timeout=COMMAND_TIMEOUT, on_timeout='prompt')
+        self.add_state('prompt', enter=self.request_prompt,
+            on=dict(errors, **{'>': 'pdu'}),
+            timeout=timeout, on_timeout=self.fail)
+        self.add_state('pdu', enter=self.write_pdu,
+            on=dict(errors, OK=self.next_part, **{'+CMGS:': self.on_CMGS}),
+            timeout=timeout, on_timeout=self.fail)
+        self.add_state('release', enter=self.release,
+            on=dict((e, self.finish) for e in ERRORS + ['OK']),
+            timeout=COMMAND_TIMEOUT, on_timeout=self.finish)
+
+    def command(self):
+        self.goto('hold' if self.multipart else 'prompt')
+
+    def hold(self):
+        self.transport.write('AT+CMMS=1\r')
+
+    def request_prompt(self):
+        pdu, length = self.pdus[0]
+        self.transport.write('AT+CMGS=%s\r' % length)
+
+    def write_pdu(self):
+        pdu, length = self.pdus.pop(0)
+        self.transport.write(pdu + TERMINATE)
+
+    def on_CMGS(self, l):
+        self.references.append(_parse_cmgs(l))
+
+    def next_part(self, l):
+        self.res = '\n'.join(self.received)
+        if self.pdus:
+            return 'prompt'
+        return self.done()
+
+    def fail(self, l=None):
+        self.res = '\n'.join(self.received) if l else TIMEOUT_RESPONSE
+        self._failure = self.res
+        return self.done()
+
+    def done(self):
+        if self.multipart:
+            return 'release'
+        self.finish()
+
+    def release(self):
+        self.transport.write('AT+CMMS=0\r')
+
+    def finish(self, l=None):
+        if self._failure:
+            self.set_error(self._failure)
+        else:
+            self.set_result(self.references)
+
+
+class ListMessages(Protocol):
+    """Lists the messages with the given status (AT+CMGL). The result
+    is the response of the modem."""
+
+    def __init__(self, ser, stat, timeout=SMS_SEND_TIMEOUT):
+        super(ListMessages, self).__init__(ser)
+        self.stat = stat
+        self.add_state('list', enter=self.list,
+            on=dict([(e, self.on_ERROR) for e in ERRORS] + [('OK', self.on_OK)]),
+            timeout=timeout)
+
+    def command(self):
+        self.goto('list')
+
+    def list(self):
+        self.transport.write('AT+CMGL=%s\r' % self.stat)
+
+    def on_OK(self, l):
+        self.set_result('\n'.join(self.received))
+
+    def on_ERROR(self, l):
+        logger.error(l)
+        self.set_error(l)
@@ -0,0 +1,102 @@
+import collections
+import re
+import select
+
+from serial_utils import monotonic
+
+
+# How many complete lines a matcher keeps. Older lines are dropped.
+MAX_LINES = 4096
+
+# Longest partial (unterminated) line a matcher keeps.
+MAX_LINE_SIZE = 4096
+
+TIMEOUT_RESPONSE = 'CME ERROR: TIMEOUT'
+
+
+class StreamMatcher(object):
+    """Splits a serial stream into lines as data arrives and looks
+    for any of the given tokens.
+
+    The tokens are compiled into a single pattern so every chunk is
+    scanned once no matter how many tokens we wait for. The
+    unterminated tail of the stream is kept around and scanned
+    again with the next chunk, so tokens split across reads are
+    still found.
+    """
+
+    def __init__(self, tokens, max_lines=MAX_LINES):
+        self.tokens = tokens
+        self._pattern = re.compile('|'.join(re.escape(t) for t in tokens))
+        self._lines = collections.deque(maxlen=max_lines)
+        self._partial = ''
+        self.match = None
+
+    def feed(self, data):
+        """Adds a chunk of the stream. Returns the first matched
+        token or None."""
+        if not data:
+            return self.match
+        text = self._partial + data
+        if self.match is None:
+            m = self._pattern.search(text)
+            if m:
+                self.match = m.group(0)
+        lines = text.split('\n')
+        self._partial = lines.pop()[-MAX_LINE_SIZE:]
+        self._lines.extend(l + '\n' for l in lines)
+        return self.match
+
+    @property
+    def lines(self):
+        """Returns the complete lines received so far."""
+        return list(self._lines)
+
+    @property
+    def text(self):
+        """Returns everything received so far (up to the buffer
+        limits) as a single string."""
+        return ''.join(self._lines) + self._partial
+
+
+def wait_readable(ser, timeout=None):
+    """Blocks until `ser` has data to read or until `timeout`
+    (seconds) runs out. A `timeout` of None blocks indefinitely.
+    Returns whether data is available."""
+    if hasattr(ser, 'wait_readable'):
+        return ser.wait_readable(timeout)
+    if ser.inWaiting():
+        return True
+    try:
+        fd = ser.fileno()
+    except (AttributeError, IOError, ValueError):
+        # No descriptor to wait on (eg. windows). Let the read
+        # block for the port's own timeout.
+        return True
+    readable, _, _ = select.select([fd], [], [], timeout)
+    return bool(readable)
+
+
+def read_available(ser, timeout=None):
+    """Waits for data up to `timeout` and returns whatever is
+    available."""
+    if not wait_readable(ser, timeout):
+        return ''
+    return ser.read(ser.inWaiting() or 1)
+
+
+def wait_for_tokens(ser, tokens, timeout=0):
+    """Reads `ser` until any of `tokens` shows up in the stream.
+    Returns the `StreamMatcher` holding what was read, or None if
+    `timeout` (seconds, may be fractional) runs out first. A
+    `timeout` of 0 blocks until a token matches."""
+    matcher = StreamMatcher(tokens)
+    deadline = monotonic() + timeout if timeout else None
+    remaining = None
+    while True:
+        if deadline is not None:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return None
+        if matcher.feed(read_available(ser, remaining)):
+            return matcher
@@ -0,0 +1,301 @@
+import logging
+import threading
+import time
+import Queue
+from contextlib import contextmanager
+
+from serial_stream import wait_readable
+
+
+logger = logging.getLogger(__name__)
+
+# Unsolicited result codes we publish to subscribers. Maps a line
+# prefix to the event type.
+URC_TYPES = [
+    ('+CMTI:', 'CMTI'),  # New message stored in the SIM.
+    ('+CDS:', 'CDS'),  # SMS status report.
+    ('+CUSD:', 'CUSD'),  # USSD response.
+    ('RING', 'RING'),  # Incoming call.
+    ('NO CARRIER', 'NO CARRIER'),  # Call ended.
+]
+
+# How much unread data we keep for command readers before we start
+# dropping the oldest bytes.
+MAX_BUFFER_SIZE = 64 * 1024
+
+# How long the reader sleeps while the port is paused.
+PAUSE_INTERVAL = 0.05
+
+# How long the reader blocks waiting for data before it checks
+# whether it has been paused or closed.
+READ_INTERVAL = 0.5
+
+
+def _unquote(s):
+    return s.strip().strip('"')
+
+
+def parse_urc(line):
+    """Parses an unsolicited result code line into an event
+    dictionary. Returns None if the line is not an URC."""
+    for prefix, type in URC_TYPES:
+        if not line.startswith(prefix):
+            continue
+        data = line[len(prefix):].strip()
+        event = {'type': type, 'line': line}
+        if type == 'CMTI':
+            storage, index = data.rsplit(',', 1)
+            event['storage'] = _unquote(storage)
+            event['index'] = int(index)
+        elif type == 'CUSD':
+            parts = data.split(',', 1)
+            event['status'] = int(parts[0])
+            event['message'] = None
+            if len(parts) > 1:
+                event['message'] = _unquote(parts[1].rsplit(',', 1)[0])
+        elif type == 'CDS':
+            event['data'] = data
+        return event
+    return None
+
+
+class Subscription(object):
+    """Queues the events of the given types until they're consumed
+    with `get()`."""
+
+    def __init__(self, port, types=None):
+        self._port = port
+        self.types = types
+        self._queue = Queue.Queue()
+
+    def __call__(self, event):
+        if self.types is None or event['type'] in self.types:
+            self._queue.put(event)
+
+    def get(self, timeout=None):
+        """Returns the next event or None once `timeout` runs out.
+        Blocks indefinitely when `timeout` is 0 or None."""
+        try:
+            # Queue.get() without a timeout can't be interrupted.
+            return self._queue.get(timeout=timeout or 1e9)
+        except Queue.Empty:
+            return None
+
+    def close(self):
+        self._port.unsubscribe(self)
+
+
+class URCSerial(object):
+    """Wraps a serial port with a background reader.
+
+    Unsolicited result codes are published to subscribers as soon
+    as they arrive. Everything read is still handed to command
+    readers (`read()`, `readall()`) so existing code that waits for
+    strings on the port keeps working.
+
+    The port is read by a shared `serial_reactor.Reactor` if one is
+    given to `start()`, or by a thread of its own otherwise.
+    """
+
+    def __init__(self, ser, max_buffer=MAX_BUFFER_SIZE):
+        self.ser = ser
+        self.port = ser.port
+        self.timeout = ser.timeout
+        self.max_buffer = max_buffer
+        self._buffer = ''
+        self._line = ''
+        self._cond = threading.Condition()
+        self._read_lock = threading.Lock()
+        self._subscribers = []
+        self._pausing = False
+        self._closed = False
+        self._reactor = None
+        self._thread = threading.Thread(target=self._read_loop,
+            name='urc-%s' % self.port)
+        self._thread.daemon = True
+
+    def start(self, reactor=None):
+        if reactor is not None and self._has_fileno():
+            self._reactor = reactor
+            reactor.register(self)
+        else:
+            self._thread.start()
+        return self
+
+    def _has_fileno(self):
+        try:
+            self.fileno()
+        except (AttributeError, IOError, ValueError):
+            return False
+        return True
+
+    def fileno(self):
+        return self.ser.fileno()
+
+    def subscribe(self, cb):
+        """Calls `cb(event)` for every URC. Callbacks run on the
+        reader thread so they should return quickly."""
+        self._subscribers.append(cb)
+        return cb
+
+    def unsubscribe(self, cb):
+        try:
+            self._subscribers.remove(cb)
+        except ValueError:
+            pass
+
+    def listen(self, types=None):
+        """Returns a `Subscription` queueing the events of the
+        given types (or all events)."""
+        return self.subscribe(Subscription(self, types))
+
+    @contextmanager
+    def paused(self):
+        """Stops reading from the port while another process (eg.
+        wvdial) talks to the modem."""
+        self._pausing = True
+        if self._reactor:
+            self._reactor.unregister(self)
+        try:
+            with self._read_lock:
+                yield
+        finally:
+            self._pausing = False
+            if self._reactor and not self._closed:
+                self._reactor.register(self)
+
+    def on_readable(self):
+        """Reads whatever the port has. Called by the reactor."""
+        # Never wait for the lock: it's held for as long as the port
+        # is paused, and the reactor reads every other port too. If
+        # the port is still readable, we're called again.
+        if self._pausing or not self._read_lock.acquire(False):
+            return
+        try:
+            if self._pausing:
+                return
+            data = self.ser.read(self.ser.inWaiting() or 1)
+        finally:
+            self._read_lock.release()
+        if data:
+            self._feed(data)
+
+    def _read_loop(self):
+        while not self._closed:
+            if self._pausing:
+                time.sleep(PAUSE_INTERVAL)
+                continue
+            try:
+                if not wait_readable(self.ser, READ_INTERVAL):
+                    continue
+                with self._read_lock:
+                    # We might have been paused while waiting.
+                    if self._pausing:
+                        continue
+                    data = self.ser.read(self.ser.inWaiting() or 1)
+            except Exception:
+                if self._closed:
+                    return
+                logger.exception('URC::Read failed: %s' % self.port)
+                time.sleep(READ_INTERVAL)
+                continue
+            if data:
+                self._feed(data)
+
+    def _feed(self, data):
+        with self._cond:
+            self._buffer = (self._buffer + data)[-self.max_buffer:]
+            self._cond.notify_all()
+        lines = (self._line + data).split('\n')
+        self._line = lines.pop()[-self.max_buffer:]
+        for l in lines:
+            l = l.strip()
+            if not l:
+                continue
+            # A malformed line mustn't take the port down with it.
+            try:
+                event = parse_urc(l)
+            except Exception:
+                logger.exception('URC::Unable to parse: %s %s' % (
+                    self.port, l))
+                continue
+            if event:
+                self._publish(event)
+
+    def _publish(self, event):
+        logger.debug('URC::Event: %s %s' % (self.port, event['line']))
+        for cb in list(self._subscribers):
+            try:
+                cb(event)
+            except Exception:
+                logger.exception('URC::Subscriber failed')
+
+    def write(self, data):
+        return self.ser.write(data)
+
+    def inWaiting(self):
+        return len(self._buffer)
+
+    def wait_readable(self, timeout=None):
+        """Blocks until there's unread data or until `timeout`
+        runs out. See `serial_stream.wait_readable()`."""
+        with self._cond:
+            if not self._buffer:
+                self._cond.wait(timeout)
+            return bool(self._buffer)
+
+    def read(self, size=1):
+        """Reads up to `size` bytes, waiting up to `self.timeout`
+        for data to arrive."""
+        with self._cond:
+            if not self._buffer:
+                self._cond.wait(self.timeout)
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readall(self):
+        """Returns all the unread data, waiting up to
+        `self.timeout` for data to arrive."""
+        with self._cond:
+            if not self._buffer:
+                self._cond.wait(self.timeout)
+            data, self._buffer = self._buffer, ''
+        return data
+
+    def flushInput(self):
+        with self._cond:
+            self._buffer = ''
+
+    def reopen(self, open_port):
+        """Closes the port and opens it again with `open_port(port)`,
+        eg. when the modem stopped responding. Raises whatever
+        `open_port` raises, in which case reading stays stopped until
+        the next reopen."""
+        if self._reactor:
+            self._reactor.unregister(self)
+        with self._read_lock:
+            try:
+                self.ser.close()
+            except Exception:
+                logger.exception('URC::Close failed: %s' % self.port)
+            self.ser = open_port(self.port)
+        self.flushInput()
+        self._line = ''
+        if self._reactor and not self._closed:
+            self._reactor.register(self)
+
+    def close(self):
+        self._closed = True
+        if self._reactor:
+            self._reactor.unregister(self)
+        self.ser.close()
+
+
+@contextmanager
+def paused(ser):
+    """Pauses the reader of `ser` if it has one."""
+    if isinstance(ser, URCSerial):
+        with ser.paused():
+            yield
+    else:
+        yield
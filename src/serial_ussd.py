@@ -23,10 +23,13 @@ ESCAPE = chr(27)
 
 class USSDSend(Protocol):
 
-    def __init__(self, ser, cmd):
+    def __init__(self, ser, cmd, reset=True):
         super(USSDSend, self).__init__(ser)
         self.cmd = to_command_seq(cmd)
         self.cmd.reverse()
+        self.reset = reset
+        # Whether the network has ended the session.
+        self.closed = False
         self._buffer = []
 
         self.on('OK', self.on_OK)
@@ -42,11 +45,13 @@ class USSDSend(Protocol):
         cmd = 'AT+CUSD=1,"%s",15\r' % cmd
         logger.debug(cmd)
 
-        # Escape first and try to reset.
-        self.transport.write(ESCAPE)
-        self.transport.readall()
-        self.transport.write('ATZ\r')
-        self.transport.readall()
+        # Escape first and try to reset, unless we know the modem
+        # isn't in the middle of something.
+        if self.reset:
+            self.transport.write(ESCAPE)
+            self.transport.readall()
+            self.transport.write('ATZ\r')
+            self.transport.readall()
 
         self.transport.write(cmd)
 
@@ -70,6 +75,7 @@ class USSDSend(Protocol):
 
     def on_CUSD_0(self, l):
         logger.debug(l)
+        self.closed = True
         self.set_result(l)
 
     def on_CUSD_1(self, l):
@@ -83,6 +89,7 @@ class USSDSend(Protocol):
         l = l.replace('+CUSD: 2,"', '')
         l = l.rstrip('",15')
         self._buffer.append(l)
+        self.closed = True
         self.set_result(l)
 
     def on_ERROR(self, l):
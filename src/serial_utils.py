@@ -32,3 +32,38 @@ def clean_lines(lines):
         if len(l) > 0:
             _lines.append(l)
     return _lines
+
+
+def monotonic():
+    """Returns the value of a clock that never goes backwards, in
+    fractional seconds."""
+    return _monotonic()
+
+
+try:
+    from time import monotonic as _monotonic
+except ImportError:
+    import ctypes
+    import os
+
+    CLOCK_MONOTONIC = 1
+
+    class _timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    try:
+        _clock_gettime = ctypes.CDLL('librt.so.1', use_errno=True)\
+            .clock_gettime
+    except OSError:
+        _clock_gettime = None
+
+    def _monotonic():
+        if _clock_gettime is None:
+            # Elapsed real time. Not strictly monotonic but it doesn't
+            # follow wall clock adjustments.
+            return os.times()[4]
+        t = _timespec()
+        if _clock_gettime(CLOCK_MONOTONIC, ctypes.pointer(t)) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return t.tv_sec + t.tv_nsec * 1e-9
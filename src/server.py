@@ -1,86 +1,208 @@
-from functools import partial
-import serial_gsm
-import serial
+import base64
+import hashlib
+import json
+import os
+
+import breaker
+import broker
+import hotplug
 import initialize
-import net_utils
-import requests
-import time
-import ftp_utils
-
-
-SERIAL_BAUDRATE = 115200
-SERIAL_TIMEOUT = 0.1
-Serial = partial(serial.Serial, baudrate=SERIAL_BAUDRATE,
-    timeout=SERIAL_TIMEOUT)
-
-
-print 'Initializing modem...'
-# Initialize modem phones.
-ports = {m: None for m in initialize.get_modems()}
-numbers = {}
-serials = {}
-unused_ports = []
-
-
-# Parse numbers.
-for port in ports.keys():
-    print 'initializing port %s' % port
-    try:
-        _ser = Serial(port)
-    except:
-        print 'unable to load port'
-        unused_ports.append(port)
-        continue
-    if not serial_gsm.check_modem(_ser):
-        print 'failed to check modem'
-        continue
-    number = serial_gsm.sim_msisdn(_ser)
-    print 'got number: %s' % number
-    if number:
-        serials[number] = _ser
-        ports[port] = number
-        numbers[number] = port
-print 'Modem initialized!'
+import jobs
+import message_store
+import modem_pool
+import modem_worker
+import serial_gsm
+import ussd_cache
+import sim_cache
+from serial_utils import monotonic
+
+
+# When a broker socket is configured, the broker process owns the
+# modems and this app only forwards requests to it. Any number of
+# workers can then serve the API. Otherwise the modems are owned by
+# this process.
+BROKER_SOCKET = os.environ.get('GSM_BROKER_SOCKET', None)
+
 
+if BROKER_SOCKET:
+    print 'Using modem broker at %s' % BROKER_SOCKET
+    pool = broker.BrokerClient(BROKER_SOCKET)
+else:
+    print 'Initializing modem...'
+    # Initialize modem phones. All the ports are probed at the same
+    # time. Numbers are cached by sim so restarts don't need to scan
+    # the phonebook of every sim again.
+    pool = modem_pool.ModemPool()
+    cache = sim_cache.SimCache()
+    pool.initialize(initialize.get_modems(), cache=cache)
+    # Modems plugged in or out from now on are added or removed as
+    # they come and go.
+    if hotplug.HOTPLUG_INTERVAL:
+        hotplug.PortWatcher(pool, cache=cache).start()
+    print 'Modem initialized!'
 
-from flask import Flask, jsonify, abort, request
+
+from flask import Flask, Response, jsonify, abort, g, request
 
 
 app = Flask(__name__)
 
 
-def ser_or_404(number):
-    ser = serials.get(number, None)
-    if not ser:
-        return abort(404)
-    return ser
+@app.errorhandler(modem_pool.UnknownModem)
+def unknown_modem(e):
+    return jsonify({'error': 'Unknown modem: %s' % e}), 404
 
 
-def port_or_404(number):
-    port = numbers.get(number, None)
-    if not port:
-        return abort(404)
-    return port
+@app.errorhandler(jobs.UnknownJob)
+def unknown_job(e):
+    return jsonify({'error': 'Unknown job: %s' % e}), 404
+
+
+@app.errorhandler(modem_worker.TaskExpired)
+def task_expired(e):
+    # The modem was too busy to get to the request in time.
+    return jsonify({'error': str(e)}), 503
+
+
+@app.errorhandler(breaker.CircuitOpen)
+def circuit_open(e):
+    # The modem keeps failing and is being recovered.
+    return jsonify({'error': str(e)}), 503
+
+
+# Use in place of a modem number to let us pick the best modem.
+ANY_MODEM = 'any'
+
+
+@app.url_value_preprocessor
+def pick_modem(endpoint, values):
+    if values and values.get('number', None) == ANY_MODEM:
+        # Sends and calls go through a modem on the same network as
+        # the number they're for, when we have one.
+        values['number'] = g.modem_number = pool.pick(
+            carrier=request.values.get('carrier', None),
+            destination=request.values.get('number', None))
+
+
+@app.after_request
+def add_modem_number(res):
+    # Let the client know which modem we picked.
+    number = getattr(g, 'modem_number', None)
+    if number:
+        res.headers['X-Modem-Number'] = number
+    return res
 
 
 @app.route('/system/available_numbers')
 def api_available_numbers():
-    return jsonify({'numbers': serials.keys()})
+    return jsonify({
+        'numbers': pool.available_numbers(),
+        'circuits': pool.circuits(),
+    })
 
 
 @app.route('/system/unused_ports')
 def api_unused_ports():
-    return jsonify({'ports': unused_ports})
+    return jsonify({'ports': pool.unused_ports()})
 
 
-@app.route('/modems/<number>/call', methods=['POST'])
-def api_call(number):
-    ser = ser_or_404(number)
+@app.route('/system/ports')
+def api_ports():
+    return jsonify({'ports': pool.probes()})
+
+
+@app.route('/system/health')
+def api_health():
+    return jsonify({'modems': pool.health_report()})
+
+
+@app.route('/system/interfaces')
+def api_interfaces():
+    return jsonify({'modems': pool.interfaces()})
+
+
+@app.route('/system/storage')
+def api_storage():
+    return jsonify({'modems': pool.storage()})
+
+
+@app.route('/system/pacing')
+def api_pacing():
+    return jsonify({'modems': pool.pacing()})
+
+
+def scheduling_params(params, priority='normal'):
+    """Returns the `priority` and `deadline` (in seconds) a request
+    asks its operation to be scheduled with. See
+    `modem_pool.scheduling()`."""
+    deadline = params.get('deadline', None)
+    return {
+        'priority': params.get('priority', priority),
+        'deadline': float(deadline) if deadline else None,
+    }
+
+
+# Request parameter parsers. Each one returns the (args, kwargs) of
+# the operation it's named after.
+def call_params(params):
+    dest_number = params['number']
+    duration = int(params.get('duration', 0))
+    return (dest_number,), {'duration': duration}
+
+
+def wait_for_call_params(params):
+    duration = int(params.get('duration', 0))
+    return (), {'duration': duration}
+
+
+def wait_for_sms_params(params):
+    origin = params['origin']
+    timeout = int(params.get('timeout', 0))
+    return (origin, timeout), {}
+
+
+def ussd_params(params):
+    command = params['command']
+    timeout = int(params.get('timeout', 0))
+    max_age = float(params.get('max_age', ussd_cache.USSD_CACHE_TTL))
+    return (command,), {'timeout': timeout, 'max_age': max_age}
 
-    dest_number = request.form['number']
-    duration = int(request.form.get('duration', 0))
 
-    res = serial_gsm.call(ser, dest_number, duration=duration)
+def data_params(params):
+    url = params['url']
+    timeout = int(params.get('timeout', 0))
+    # TODO: Turn the ff into a required argument in the
+    # future.
+    apn = params.get('apn', 'http.globe.com.ph')
+    dial = params.get('dial', '*99#')
+    wait_connect = int(params.get('wait_connect', 5))
+
+    # Optionally trigger a dns refresh in each request
+    refresh_dns = params.get('refresh_dns', 'false').lower() == 'true'
+
+    return (url, apn), {
+        'timeout': timeout,
+        'wait_connect': wait_connect,
+        'refresh_dns': refresh_dns,
+    }
+
+
+# Operations that can be started as jobs. Maps the endpoint name to
+# the pool operation and its parameter parser.
+JOB_OPERATIONS = {
+    'call': ('call', call_params),
+    'wait_for_call': ('wait_for_call', wait_for_call_params),
+    'wait_for_sms': ('wait_for_sms', wait_for_sms_params),
+    'ussd': ('ussd', ussd_params),
+    'data': ('data_request', data_params),
+}
+
+
+@app.route('/modems/<number>/call', methods=['POST'])
+def api_call(number):
+    args, kwargs = call_params(request.form)
+    kwargs.update(scheduling_params(request.form, 'interactive'))
+    res = pool.run(number, 'call', *args, **kwargs)
     # We were unable to connect the call.
     if res.get('connected', False):
         return jsonify(res), 400
@@ -89,9 +211,9 @@ def api_call(number):
 
 @app.route('/modems/<number>/wait_for_call', methods=['POST'])
 def api_wait_for_call(number):
-    ser = ser_or_404(number)
-    duration = int(request.form.get('duration', 0))
-    res = serial_gsm.wait_and_answer_call(ser, duration=duration)
+    args, kwargs = wait_for_call_params(request.form)
+    kwargs.update(scheduling_params(request.form, 'interactive'))
+    res = pool.wait_for_call(number, *args, **kwargs)
     # We were unable to connect the call.
     if res.get('connected', False):
         return jsonify(res), 400
@@ -100,36 +222,68 @@ def api_wait_for_call(number):
 
 @app.route('/modems/<number>/send_sms', methods=['POST'])
 def api_send_sms(number):
-    ser = ser_or_404(number)
     recipient = request.form['number']
     message = request.form['message']
-    res = serial_gsm.send_sms(ser, recipient, message)
+    res = pool.run(number, 'send_sms', recipient, message,
+        **scheduling_params(request.form, 'interactive'))
     # We were unable to send the sms
     if res.get('success', False):
         return jsonify(res), 500
     return jsonify(res)
 
 
+def inbox_params(params):
+    since = params.get('since', None)
+    until = params.get('until', None)
+    return {
+        'origin': params.get('origin', None),
+        'since': float(since) if since else None,
+        'until': float(until) if until else None,
+        'limit': int(params.get('limit', message_store.MESSAGES_LIMIT)),
+        'offset': int(params.get('offset', 0)),
+    }
+
+
 @app.route('/modems/<number>/inbox')
 def api_inbox(number):
-    ser = ser_or_404(number)
-    return jsonify({
-        'messages': serial_gsm.inbox_messages(ser)
-    })
+    # Clients polling the inbox get a 304 until it changes.
+    etag = hashlib.md5('%s?%s' % (pool.inbox_version(number),
+        request.query_string)).hexdigest()
+    if request.if_none_match.contains(etag):
+        res = Response(status=304)
+    else:
+        res = jsonify({
+            'messages': pool.messages(number, **inbox_params(request.args))
+        })
+    res.set_etag(etag)
+    return res
 
 
 @app.route('/modems/<number>/inbox', methods=['DELETE'])
 def api_clear_inbox(number):
-    ser = ser_or_404(number)
-    return jsonify(serial_gsm.delete_inbox_messages(ser))
+    return jsonify(pool.clear_inbox(number))
+
+
+@app.route('/modems/<number>/storage')
+def api_modem_storage(number):
+    return jsonify({'storage': pool.storage([number])[number]})
+
+
+@app.route('/modems/<number>/storage', methods=['DELETE'])
+def api_clear_storage(number):
+    # Only clears the sim. Stored messages are kept.
+    flag = serial_gsm.CMGD_DELETE_ALL
+    if request.args.get('status', 'all') == 'read':
+        flag = serial_gsm.CMGD_DELETE_READ
+    res = pool.run(number, 'delete_inbox_messages', flag)
+    res['storage'] = pool.storage([number])[number]
+    return jsonify(res)
 
 
 @app.route('/modems/<number>/wait_for_sms')
 def api_wait_for_sms(number):
-    ser = ser_or_404(number)
-    origin = request.args['origin']
-    timeout = int(request.args.get('timeout', 0))
-    res = serial_gsm.wait_for_sms(ser, origin, timeout)
+    args, kwargs = wait_for_sms_params(request.args)
+    res = pool.wait_for_sms(number, *args, **kwargs)
     # SMS waited probably never came. Try again?
     if res.get('error', 'an error'):
         return jsonify(res), 400
@@ -138,10 +292,9 @@ def api_wait_for_sms(number):
 
 @app.route('/modems/<number>/ussd', methods=['POST'])
 def api_send_ussd(number):
-    ser = ser_or_404(number)
-    command = request.form['command']
-    timeout = int(request.form.get('timeout', 0))
-    res = serial_gsm.ussd_send(ser, command, timeout=timeout)
+    args, kwargs = ussd_params(request.form)
+    kwargs.update(scheduling_params(request.form, 'interactive'))
+    res = pool.ussd(number, *args, **kwargs)
     # USSD requests are more prone to system errors.
     if res.get('success', False):
         return jsonify(res), 500
@@ -150,75 +303,27 @@ def api_send_ussd(number):
 
 @app.route('/modems/<number>/data', methods=['POST'])
 def api_data_request(number):
-    url = request.form['url']
-    timeout = int(request.form.get('timeout', 0))
-    port = port_or_404(number)
-    # TODO: Turn the ff into a required argument in the
-    # future.
-    apn = request.form.get('apn', 'http.globe.com.ph')
-    dial = request.form.get('dial', '*99#')
-    wait_connect = int(request.form.get('wait_connect', 5))
-
-    # Optionally trigger a dns refresh in each request
-    refresh_dns = request.form.get('refresh_dns', 'false').lower() == 'true'
-
-    if refresh_dns:
-        net_utils.flush_dns()
-
-    proc = net_utils.connect_wvdial(port, apn, wait_connect=wait_connect)
-
-    # TODO: Implement a dynamic interface system so we can handle multiple
-    # connected interfaces in a single server.
-    res, err = net_utils.check_if_connected('ppp0')
-
-    if not res:
-        proc.terminate()
-        return jsonify({
-            'error': 'Unable to establish a connection to the network: %s. Try increasing the `wait_connect` parameter.' % err,
-            'url': url,
-            'response_body_size': None,
-            'response_header_size': None,
-            'response_status_code': None,
-        }), 500
-
-
-    with net_utils.use_interface('ppp0'):
-        try:
-            r = requests.get(url, timeout=timeout)
-        except requests.ConnectionError:
-            proc.terminate()
-            return jsonify({
-                'error': 'Request timed-out. Unable to connect to the url specified. Try increasing the `timeout` parameter.',
-                'url': url,
-                'response_body_size': None,
-                'response_header_size': None,
-                'response_status_code': None,
-            })
-
-    # Let's close the interface, finally.
-    proc.terminate()
-
-    return jsonify({
-        'error': None,
-        'url': url,
-        'response_body_size': len(r.text),
-        'response_header_size': None,
-        'response_status_code': r.status_code,
-    })
+    args, kwargs = data_params(request.form)
+    kwargs.update(scheduling_params(request.form, 'interactive'))
+    # The dial-up session runs on the modem's worker so no other
+    # command gets written to the port while wvdial owns it.
+    res = pool.run(number, 'data_request', *args, **kwargs)
+    if not res['connected']:
+        return jsonify(res), 500
+    return jsonify(res)
 
 
 @app.route('/modems/<number>/ftp', methods=['POST'])
 def api_ftp_request(number):
     ftp_filename = request.form['ftp_filename']
     ftp_host = request.form['ftp_host']
-    ftp_file = request.form['ftp_file']
+    ftp_file = request.files['ftp_file']
     ftp_path = request.form['ftp_path']
     ftp_port = int(request.form.get('ftp_port', 21))
     ftp_username = request.form.get('ftp_username', None)
     ftp_password = request.form.get('ftp_password', None)
 
     timeout = int(request.form.get('timeout', 0))
-    port = port_or_404(number)
     # TODO: Turn the ff into a required argument in the
     # future.
     apn = request.form.get('apn', 'http.globe.com.ph')
@@ -228,49 +333,129 @@ def api_ftp_request(number):
     # Optionally trigger a dns refresh in each request
     refresh_dns = request.form.get('refresh_dns', 'false').lower() == 'true'
 
-    if refresh_dns:
-        net_utils.flush_dns()
-
-    proc = net_utils.connect_wvdial(port, apn, wait_connect=wait_connect)
-
-    # TODO: Implement a dynamic interface system so we can handle multiple
-    # connected interfaces in a single server.
-    res, err = net_utils.check_if_connected('ppp0')
-
-    if not res:
-        proc.terminate()
-        return jsonify({
-            'error': 'Unable to establish a connection to the network: %s. Try increasing the `wait_connect` parameter.' % err,
-            'success': False,
-        }), 500
-
-
-    with net_utils.use_interface('ppp0'):
-        try:
-            ftp_utils.upload(
-                ftp_file,
-                ftp_host,
-                ftp_filename=ftp_filename,
-                ftp_port=ftp_port,
-                ftp_username=ftp_username,
-                ftp_password=ftp_password,
-                upload_path=ftp_path,
-                timeout=timeout
-            )
-        except Exception:
-            proc.terminate()
-            return jsonify({
-                'error': 'Request timed-out. Failed to upload. Try increasing the `timeout` parameter.',
-                'success': False,
-            })
-
-    # Let's close the interface, finally.
-    proc.terminate()
+    res = pool.run(number, 'ftp_request',
+        base64.b64encode(ftp_file.read()), ftp_host, apn,
+        ftp_filename=ftp_filename, ftp_path=ftp_path, ftp_port=ftp_port,
+        ftp_username=ftp_username, ftp_password=ftp_password,
+        timeout=timeout, wait_connect=wait_connect, refresh_dns=refresh_dns,
+        **scheduling_params(request.form, 'interactive'))
+    if not res['connected']:
+        return jsonify(res), 500
+    return jsonify(res)
+
 
-    return jsonify({
-        'error': None,
-        'success': True,
-    })
+@app.route('/modems/<number>/jobs/<operation>', methods=['POST'])
+def api_submit_job(number, operation):
+    if operation not in JOB_OPERATIONS:
+        return abort(404)
+    op, parse_params = JOB_OPERATIONS[operation]
+    args, kwargs = parse_params(request.values)
+    kwargs.update(scheduling_params(request.values))
+    job = pool.submit_job(number, op, *args, **kwargs)
+    return jsonify({'job': job}), 202
+
+
+# How long we wait for bulk sends to finish between checks.
+BULK_SMS_WAIT = 15
+# How long a streamed response (or long-poll) runs before we end it,
+# in seconds. Each one holds a gunicorn thread for as long as it runs.
+STREAM_TIMEOUT = float(os.environ.get('GSM_STREAM_TIMEOUT', 300))
+
+
+def stream_bulk_results(sent):
+    """Streams a JSON line for each message as soon as it's sent. Jobs
+    still pending after `STREAM_TIMEOUT` seconds are streamed as they
+    are, for the client to check on later."""
+    indexes = dict((job['id'], i) for i, job in enumerate(sent))
+    pending = set(indexes)
+    end = monotonic() + STREAM_TIMEOUT
+    while pending and monotonic() < end:
+        wait = min(BULK_SMS_WAIT, max(end - monotonic(), 0))
+        for job in pool.finished_jobs(list(pending), wait=wait):
+            pending.discard(job['id'])
+            yield json.dumps({'index': indexes[job['id']], 'job': job}) + '\n'
+    for job_id in sorted(pending, key=indexes.get):
+        yield json.dumps({'index': indexes[job_id],
+            'job': pool.job(job_id)}) + '\n'
+
+
+@app.route('/sms/bulk', methods=['POST'])
+def api_send_bulk_sms():
+    params = request.get_json(force=True)
+    messages = params['messages']
+    numbers = params.get('modems', None)
+    sent = pool.send_bulk(messages, numbers)
+    # Clients that don't want to wait can check on each job instead.
+    if request.args.get('stream', 'true').lower() == 'false':
+        return jsonify({'jobs': sent}), 202
+    return Response(stream_bulk_results(sent),
+        mimetype='application/x-ndjson')
+
+
+@app.route('/jobs/<job_id>')
+def api_job(job_id):
+    # Optionally long-poll until the job finishes.
+    wait = float(request.args.get('wait', 0))
+    return jsonify({'job': pool.job(job_id, wait=wait)})
+
+
+# How long an event request waits for new events.
+EVENTS_TIMEOUT = 30
+# How often we send a keep-alive to streaming clients.
+EVENTS_KEEPALIVE = 15
+
+
+def event_filters(number=None):
+    types = request.args.get('types', None)
+    return {
+        'number': number,
+        'types': types.split(',') if types else None,
+        'origin': request.args.get('origin', None),
+    }
+
+
+def stream_events(after, filters):
+    """Streams events as server-sent events for up to
+    `STREAM_TIMEOUT` seconds."""
+    # Let the client know we're connected.
+    yield ': connected\n\n'
+    end = monotonic() + STREAM_TIMEOUT
+    while monotonic() < end:
+        timeout = min(EVENTS_KEEPALIVE, max(end - monotonic(), 0))
+        events = pool.events_since(after, timeout=timeout, **filters)
+        if not events:
+            yield ': keep-alive\n\n'
+            continue
+        for e in events:
+            yield 'id: %s\nevent: %s\ndata: %s\n\n' % (
+                e['id'], e['type'], json.dumps(e))
+        after = events[-1]['id']
+
+
+def api_events(number=None):
+    filters = event_filters(number)
+    after = request.args.get('after', None) or \
+        request.headers.get('Last-Event-ID', None)
+    # Without a starting point, we only send new events.
+    after = int(after) if after else pool.last_event_id()
+
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        if number is not None and number not in pool.available_numbers():
+            raise modem_pool.UnknownModem(number)
+        return Response(stream_events(after, filters),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache'})
+
+    timeout = min(float(request.args.get('timeout', EVENTS_TIMEOUT)),
+        STREAM_TIMEOUT)
+    events = pool.events_since(after, timeout=timeout, **filters)
+    if events:
+        after = events[-1]['id']
+    return jsonify({'events': events, 'last_id': after})
+
+
+app.add_url_rule('/events', 'api_events', api_events)
+app.add_url_rule('/modems/<number>/events', 'api_modem_events', api_events)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,58 @@
+import json
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# Where we keep the numbers we've resolved so far.
+SIM_CACHE_PATH = os.environ.get('GSM_SIM_CACHE', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '.sim_cache.json'))
+
+
+class SimCache(object):
+    """Remembers the number of each sim we've seen, keyed by the sim
+    identity (see `serial_gsm.sim_identity()`), so we don't have to
+    scan the phonebook again on restarts."""
+
+    def __init__(self, path=SIM_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._sims = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError) as e:
+            logger.info('SIMCACHE::Unable to load %s: %s' % (self.path, e))
+            return {}
+
+    def _save(self):
+        # Write to a temporary file first so a crash never leaves a
+        # truncated cache behind.
+        tmp = '%s.%s.tmp' % (self.path, os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(self._sims, f, indent=2, sort_keys=True)
+            os.rename(tmp, self.path)
+        except (IOError, OSError) as e:
+            logger.warning('SIMCACHE::Unable to save %s: %s' % (self.path, e))
+
+    def get(self, identity):
+        """Returns the cached number of a sim or None."""
+        with self._lock:
+            sim = self._sims.get(identity, None)
+        if not sim:
+            return None
+        return sim['number']
+
+    def set(self, identity, number):
+        with self._lock:
+            sim = self._sims.get(identity, None)
+            if sim and sim['number'] == number:
+                return
+            self._sims[identity] = {'number': number, 'updated': int(time.time())}
+            self._save()
@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+"""SMS PDU codec (3GPP TS 23.040).
+
+Decodes the PDUs listed by the modem in PDU mode (AT+CMGF=0) and
+encodes SMS-SUBMIT PDUs for sending. Supports the GSM 7-bit default
+alphabet (and its extension table), 8-bit data and UCS2, and
+concatenated messages (user data headers).
+"""
+import binascii
+import random
+
+
+# GSM 03.38 default alphabet. The index of a character is its code.
+GSM7_ALPHABET = (
+    u'@£$¥èéùìòÇ\nØø\rÅå'
+    u'Δ_ΦΓΛΩΠΨΣΘΞ\x1bÆæßÉ'
+    u' !"#¤%&\'()*+,-./'
+    u'0123456789:;<=>?'
+    u'¡ABCDEFGHIJKLMNO'
+    u'PQRSTUVWXYZÄÖÑÜ§'
+    u'¿abcdefghijklmno'
+    u'pqrstuvwxyzäöñüà'
+)
+
+# Characters of the extension table. Sent as ESC followed by the code.
+GSM7_ESCAPE = 0x1b
+GSM7_EXTENSION = {
+    0x0a: u'\x0c',
+    0x14: u'^',
+    0x28: u'{',
+    0x29: u'}',
+    0x2f: u'\\',
+    0x3c: u'[',
+    0x3d: u'~',
+    0x3e: u']',
+    0x40: u'|',
+    0x65: u'€',
+}
+
+GSM7_CODES = dict((c, i) for i, c in enumerate(GSM7_ALPHABET) if i != GSM7_ESCAPE)
+GSM7_EXTENSION_CODES = dict((c, i) for i, c in GSM7_EXTENSION.items())
+
+# Data coding schemes
+ALPHABET_GSM7 = 'gsm7'
+ALPHABET_8BIT = '8bit'
+ALPHABET_UCS2 = 'ucs2'
+
+# Message type indicators (first octet, bits 0-1).
+MTI_DELIVER = 0
+MTI_SUBMIT = 1
+MTI_STATUS_REPORT = 2
+
+TYPE_DELIVER = 'deliver'
+TYPE_SUBMIT = 'submit'
+TYPE_STATUS_REPORT = 'status_report'
+
+# Type-of-address
+TOA_INTERNATIONAL = 0x91
+TOA_UNKNOWN = 0x81
+TON_MASK = 0x70
+TON_INTERNATIONAL = 0x10
+TON_ALPHANUMERIC = 0x50
+
+# Information element ids of concatenated messages.
+IEI_CONCAT_8BIT = 0x00
+IEI_CONCAT_16BIT = 0x08
+
+# How much user data fits in a single message.
+MAX_SEPTETS = 160
+MAX_OCTETS = 140
+# How much fits in each part of a concatenated message, after the
+# 6 octet user data header.
+MAX_PART_SEPTETS = 153
+MAX_PART_UCS2_CHARS = 67
+
+
+class PDUError(ValueError):
+    """Raised when a PDU can't be decoded."""
+
+
+class _Reader(object):
+    """Reads a PDU octet by octet."""
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def octet(self):
+        return ord(self.read(1))
+
+    def read(self, n):
+        if self.pos + n > len(self.data):
+            raise PDUError('PDU is truncated.')
+        res = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return res
+
+    def rest(self):
+        res = self.data[self.pos:]
+        self.pos = len(self.data)
+        return res
+
+
+def unpack_septets(data, count, fill_bits=0):
+    """Unpacks `count` 7-bit values from packed octets, skipping
+    the first `fill_bits` bits."""
+    n = int(binascii.hexlify(data[::-1]), 16) if data else 0
+    return [(n >> (fill_bits + 7 * i)) & 0x7f for i in range(count)]
+
+
+def pack_septets(septets, fill_bits=0):
+    """Packs 7-bit values into octets, leaving `fill_bits` zero bits
+    in front."""
+    n = 0
+    for i, s in enumerate(septets):
+        n |= s << (fill_bits + 7 * i)
+    size = (fill_bits + 7 * len(septets) + 7) // 8
+    if not size:
+        return ''
+    data = ('%x' % n).rjust(size * 2, '0')
+    return binascii.unhexlify(data)[::-1]
+
+
+def decode_gsm7(septets):
+    chars = []
+    escaped = False
+    for s in septets:
+        if escaped:
+            chars.append(GSM7_EXTENSION.get(s, u' '))
+            escaped = False
+        elif s == GSM7_ESCAPE:
+            escaped = True
+        else:
+            chars.append(GSM7_ALPHABET[s])
+    return u''.join(chars)
+
+
+def encode_gsm7(text):
+    """Returns the septets of `text` or None if it has characters
+    outside of the GSM 7-bit alphabet."""
+    septets = []
+    for c in text:
+        if c in GSM7_CODES:
+            septets.append(GSM7_CODES[c])
+        elif c in GSM7_EXTENSION_CODES:
+            septets.extend([GSM7_ESCAPE, GSM7_EXTENSION_CODES[c]])
+        else:
+            return None
+    return septets
+
+
+def _decode_semi_octets(data):
+    digits = []
+    for o in bytearray(data):
+        digits.append('%x' % (o & 0x0f))
+        digits.append('%x' % (o >> 4))
+    return ''.join(digits).rstrip('f')
+
+
+def _encode_semi_octets(digits):
+    if len(digits) % 2:
+        digits += 'F'
+    return binascii.unhexlify(''.join(
+        digits[i + 1] + digits[i] for i in range(0, len(digits), 2)))
+
+
+def _decode_address(r):
+    """Reads an originating/destination address."""
+    length = r.octet()  # Number of useful semi-octets.
+    toa = r.octet()
+    data = r.read((length + 1) // 2)
+    if toa & TON_MASK == TON_ALPHANUMERIC:
+        return decode_gsm7(unpack_septets(data, length * 4 // 7))
+    number = _decode_semi_octets(data)[:length]
+    if toa & TON_MASK == TON_INTERNATIONAL:
+        number = '+' + number
+    return number
+
+
+def _encode_address(number):
+    toa = TOA_UNKNOWN
+    if number.startswith('+'):
+        toa = TOA_INTERNATIONAL
+    number = str(''.join(c for c in number if c.isdigit()))
+    return chr(len(number)) + chr(toa) + _encode_semi_octets(number)
+
+
+def _decode_smsc(r):
+    length = r.octet()
+    if not length:
+        return None
+    toa = r.octet()
+    number = _decode_semi_octets(r.read(length - 1))
+    if toa & TON_MASK == TON_INTERNATIONAL:
+        number = '+' + number
+    return number
+
+
+def _decode_timestamp(data):
+    """Decodes a service centre timestamp into ('MM/DD/YY',
+    'HH:MM:SS')."""
+    # Each field is BCD with its nibbles swapped.
+    y, mo, day, h, mi, s = [(o & 0x0f) * 10 + (o >> 4)
+        for o in bytearray(data[:6])]
+    return '%02d/%02d/%02d' % (mo, day, y), '%02d:%02d:%02d' % (h, mi, s)
+
+
+def _alphabet(dcs):
+    if dcs & 0x80 == 0:
+        # General data coding group.
+        return [ALPHABET_GSM7, ALPHABET_8BIT, ALPHABET_UCS2,
+            ALPHABET_GSM7][(dcs >> 2) & 0x03]
+    if dcs & 0xf0 == 0xf0:
+        return ALPHABET_8BIT if dcs & 0x04 else ALPHABET_GSM7
+    if dcs & 0xf0 == 0xe0:
+        return ALPHABET_UCS2
+    return ALPHABET_GSM7
+
+
+def _parse_udh(udh):
+    """Returns the concatenation info of a user data header or
+    None."""
+    i = 0
+    while i + 1 < len(udh):
+        iei, length = ord(udh[i]), ord(udh[i + 1])
+        ie = bytearray(udh[i + 2:i + 2 + length])
+        if iei == IEI_CONCAT_8BIT and length == 3:
+            return {'ref': ie[0], 'total': ie[1], 'seq': ie[2]}
+        if iei == IEI_CONCAT_16BIT and length == 4:
+            return {'ref': (ie[0] << 8) | ie[1], 'total': ie[2], 'seq': ie[3]}
+        i += 2 + length
+    return None
+
+
+def _decode_user_data(r, dcs, udhi):
+    udl = r.octet()
+    data = r.rest()
+    alphabet = _alphabet(dcs)
+    concat = None
+    header_size = 0
+    if udhi and data:
+        header_size = ord(data[0]) + 1
+        concat = _parse_udh(data[1:header_size])
+    if alphabet == ALPHABET_GSM7:
+        fill_bits = (7 - (header_size * 8) % 7) % 7
+        header_septets = (header_size * 8 + fill_bits) // 7
+        septets = unpack_septets(data[header_size:], udl - header_septets,
+            fill_bits)
+        text = decode_gsm7(septets)
+    elif alphabet == ALPHABET_UCS2:
+        text = data[header_size:udl].decode('utf-16-be', 'replace')
+    else:
+        text = data[header_size:udl].decode('latin-1')
+    return text, concat
+
+
+def decode(pdu):
+    """Decodes a hex encoded PDU as listed by AT+CMGL/AT+CMGR,
+    including the SMSC address. Returns a dictionary."""
+    try:
+        r = _Reader(binascii.unhexlify(pdu.strip()))
+    except (TypeError, binascii.Error) as e:
+        raise PDUError('Invalid PDU: %s' % e)
+    smsc = _decode_smsc(r)
+    first = r.octet()
+    mti = first & 0x03
+    udhi = bool(first & 0x40)
+    message = {
+        'smsc': smsc,
+        'origin': None,
+        'date': None,
+        'time': None,
+        'message': None,
+        'concat': None,
+    }
+    if mti == MTI_DELIVER:
+        message['type'] = TYPE_DELIVER
+        message['origin'] = _decode_address(r)
+        r.octet()  # Protocol identifier
+        dcs = r.octet()
+        message['date'], message['time'] = _decode_timestamp(r.read(7))
+    elif mti == MTI_SUBMIT:
+        message['type'] = TYPE_SUBMIT
+        r.octet()  # Message reference
+        # Stored outgoing messages list the recipient.
+        message['origin'] = _decode_address(r)
+        r.octet()  # Protocol identifier
+        dcs = r.octet()
+        vpf = (first >> 3) & 0x03
+        if vpf == 2:
+            r.read(1)
+        elif vpf:
+            r.read(7)
+    elif mti == MTI_STATUS_REPORT:
+        message['type'] = TYPE_STATUS_REPORT
+        message['reference'] = r.octet()
+        message['origin'] = _decode_address(r)
+        message['date'], message['time'] = _decode_timestamp(r.read(7))
+        r.read(7)  # Discharge time
+        message['delivery_status'] = r.octet()
+        return message
+    else:
+        raise PDUError('Unsupported message type: %s' % mti)
+    message['message'], message['concat'] = _decode_user_data(r, dcs, udhi)
+    return message
+
+
+def merge_parts(messages):
+    """Merges the parts of concatenated messages by reference and
+    sequence number, no matter the order they're in.
+
+    Expects message dictionaries with the `concat` info of `decode()`
+    and an `index`. The merged message takes the index of its first
+    part, lists the index of every part in `indexes` and tells
+    whether all the parts are there in `complete`.
+    """
+    merged = []
+    groups = {}
+    for m in messages:
+        m = dict(m)
+        concat = m.pop('concat', None)
+        m['indexes'] = [m['index']]
+        m['complete'] = True
+        if not concat or concat['total'] < 2:
+            merged.append(m)
+            continue
+        key = (m['origin'], concat['ref'], concat['total'])
+        groups.setdefault(key, {})[concat['seq']] = m
+    for (_, _, total), parts in groups.items():
+        parts = [parts[seq] for seq in sorted(parts)]
+        m = dict(parts[0])
+        m['message'] = u''.join(p['message'] for p in parts)
+        m['indexes'] = sorted(p['index'] for p in parts)
+        m['index'] = m['indexes'][0]
+        m['complete'] = len(parts) == total
+        merged.append(m)
+    return sorted(merged, key=lambda m: m['index'])
+
+
+def _split_gsm7(septets, size):
+    """Splits septets in parts of `size` without splitting an escape
+    sequence."""
+    parts = []
+    while septets:
+        n = size
+        if len(septets) > n and septets[n - 1] == GSM7_ESCAPE:
+            n -= 1
+        parts.append(septets[:n])
+        septets = septets[n:]
+    return parts
+
+
+def _split_ucs2(text, size):
+    """Splits text in parts of `size` UTF-16 code units without
+    splitting a surrogate pair."""
+    units = text.encode('utf-16-be')
+    parts = []
+    while units:
+        n = size * 2
+        if len(units) > n and 0xd8 <= ord(units[n - 2]) <= 0xdb:
+            n -= 2
+        parts.append(units[:n])
+        units = units[n:]
+    return parts
+
+
+def encode_submit(number, text, ref=None, status_report=False):
+    """Encodes an SMS-SUBMIT for `text`. Long texts are split into
+    the parts of a concatenated message.
+
+    Returns a list of (hex pdu, tpdu length) tuples, one per part.
+    The PDUs use the SMSC stored in the sim. The length is the one
+    AT+CMGS expects (not counting the SMSC octet).
+    """
+    if not isinstance(text, unicode):
+        text = text.decode('utf-8')
+    septets = encode_gsm7(text)
+    if septets is not None:
+        dcs = 0x00
+        if len(septets) <= MAX_SEPTETS:
+            parts = [septets]
+        else:
+            parts = _split_gsm7(septets, MAX_PART_SEPTETS)
+    else:
+        dcs = 0x08
+        units = text.encode('utf-16-be')
+        if len(units) <= MAX_OCTETS:
+            parts = [units]
+        else:
+            parts = _split_ucs2(text, MAX_PART_UCS2_CHARS)
+
+    if ref is None:
+        ref = random.randint(0, 0xff)
+    first = MTI_SUBMIT
+    if len(parts) > 1:
+        first |= 0x40
+    if status_report:
+        first |= 0x20
+
+    pdus = []
+    for seq, part in enumerate(parts, 1):
+        header = ''
+        if len(parts) > 1:
+            header = chr(5) + chr(IEI_CONCAT_8BIT) + chr(3) + \
+                chr(ref & 0xff) + chr(len(parts)) + chr(seq)
+        if dcs == 0x00:
+            fill_bits = (7 - (len(header) * 8) % 7) % 7
+            udl = (len(header) * 8 + fill_bits) // 7 + len(part)
+            ud = header + pack_septets(part, fill_bits)
+        else:
+            udl = len(header) + len(part)
+            ud = header + part
+        tpdu = chr(first) + chr(0) + _encode_address(number) + chr(0) + \
+            chr(dcs) + chr(udl) + ud
+        pdus.append(('00' + binascii.hexlify(tpdu).upper(), len(tpdu)))
+    return pdus
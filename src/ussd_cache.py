@@ -0,0 +1,47 @@
+import os
+import threading
+
+from serial_utils import monotonic
+
+
+# How long USSD responses are reused by default, in seconds. 0 turns
+# the cache off unless a request asks for it.
+USSD_CACHE_TTL = float(os.environ.get('GSM_USSD_CACHE_TTL', 0))
+
+
+class USSDCache(object):
+    """Reuses the responses of USSD commands for a while, by modem and
+    command, and lets identical commands running at the same time
+    share a single USSD session."""
+
+    def __init__(self):
+        self._responses = {}  # (number, command) -> (time, response)
+        self._running = {}  # (number, command) -> Task
+        self._lock = threading.Lock()
+
+    def get(self, number, command, submit, max_age=USSD_CACHE_TTL):
+        """Returns the response of `command` on the modem `number`.
+
+        If we got a response less than `max_age` seconds ago, it's
+        returned right away. If the same command is already running,
+        we wait for its response. Otherwise `submit()` is called to
+        start the command and should return a `Task`.
+        """
+        key = (number, command)
+        with self._lock:
+            cached = self._responses.get(key, None)
+            if cached and max_age and monotonic() - cached[0] <= max_age:
+                return cached[1]
+            task = self._running.get(key, None)
+            if task is None:
+                task = self._running[key] = submit()
+        try:
+            res = task.wait()
+        finally:
+            with self._lock:
+                if self._running.get(key, None) is task:
+                    del self._running[key]
+        if res['error'] is None and res['message']:
+            with self._lock:
+                self._responses[key] = (monotonic(), res)
+        return res